@@ -42,11 +42,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'store.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.middleware.ThrottleMiddleware',
+    'store.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 
@@ -68,6 +72,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'store.context_processors.cart',
             ],
         },
     },
@@ -83,9 +88,91 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Every new SQLite connection gets store.db.DEFAULT_SQLITE_PRAGMAS; set
+# SQLITE_PRAGMAS to a dict of just the pragmas to change (None drops one).
+# SQLITE_PRAGMAS = {
+#     'synchronous': 'FULL',
+#     'mmap_size': None,
+# }
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# The local-memory cache is per process. When running several workers, switch
+# to a shared backend such as
+# 'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION of
+# BASE_DIR / 'cache' so catalog invalidations reach every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecommerce',
+    }
+}
+
+STORE_CATALOG_CACHE = 'default'
+
+
+# Per-view query budgets, keyed by URL name. QueryBudgetMiddleware logs a
+# warning with the duplicated SQL when a request goes over; store/tests.py
+# asserts the exact counts.
+
+QUERY_BUDGETS = {
+    'store': 6,
+    'cart': 8,
+    'checkout': 8,
+    'update_item': 18,
+    'update_cart': 28,
+    'order_history': 8,
+    'order_details': 8,
+    'sales_dashboard': 8,
+}
+
+QUERY_BUDGET_DEFAULT = 20
+
+
+# Stock-tracked products keep their stock in this many StockBucket rows, and
+# cart holds last this long before release_reservations returns them.
+
+STOCK_BUCKETS = 8
+
+STOCK_HOLD_SECONDS = 15 * 60
+
+
+# refresh_sales_rollups leaves orders completed in the last this many
+# seconds for its next run.
+
+SALES_ROLLUP_LAG_SECONDS = 60
+
+
+# Background jobs (store.jobs) are queued in the database for run_worker.
+# Eager mode runs them in-process after the enqueuing transaction commits,
+# for development without a worker.
+
+STORE_JOBS_EAGER = False
+
+
+# Token-bucket limits on POSTs, keyed by URL name: 'N/period' allows a burst
+# of N, refilled over the period, per client IP and per logged-in user.
+# LocalBuckets keeps them per process; with several worker processes use
+# store.throttle.FileBuckets, which shares them through THROTTLE_FILE.
+
+THROTTLE_RATES = {
+    'update_item': {'ip': '30/10s', 'user': '20/10s'},
+    'update_cart': {'ip': '30/10s', 'user': '20/10s'},
+    'login': {'ip': '10/min'},
+    'register': {'ip': '5/min'},
+}
+
+THROTTLE_BACKEND = 'store.throttle.LocalBuckets'
+
+THROTTLE_FILE = BASE_DIR / 'throttle.buckets'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -106,6 +193,9 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+LOGIN_URL = 'login'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -133,6 +223,34 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static')
 ]
 
+# CSS/JS bundles built by `manage.py build_assets` into ASSET_BUILD_DIR as
+# content-hashed, gzip and brotli precompressed files. WhiteNoise serves the
+# precompressed variants and marks hashed names as immutable.
+ASSET_BUILD_DIR = os.path.join(BASE_DIR, 'static/dist')
+
+ASSET_BUNDLES = {
+    'base.css': ['css/main.css', 'css/footer.css'],
+    'account.css': ['css/style.css'],
+    'about.css': ['css/about_style.css'],
+    'contact.css': ['css/contact_style.css'],
+    'faq.css': ['css/faq_style.css'],
+    'gift.css': ['css/gift_style.css'],
+    'offer.css': ['css/offer_style.css'],
+    'profile.css': ['css/profile_style.css'],
+    'returns.css': ['css/returns_style.css'],
+    'cart.js': ['js/cart.js'],
+}
+
+
+# Content pages rendered by `manage.py prerender_pages` (see store.prerender).
+# Served pages are re-rendered when their templates are newer than the
+# files, checked at most every PRERENDER_CHECK_SECONDS.
+PRERENDER_DIR = os.path.join(BASE_DIR, 'prerendered')
+
+PRERENDER_CHECK_SECONDS = 2
+
+WHITENOISE_IMMUTABLE_FILE_TEST = r'^.+\.[0-9a-f]{12}\..+$'
+
 MEDIA_URL = '/images/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'static/images')
@@ -7,58 +7,83 @@ for (i = 0; i < updateBtns.length; i++) {
 		console.log('productId:', productId, 'Action:', action)
 		console.log('USER:', user)
 
-		if (user == 'AnonymousUser'){
-			addCookieItem(productId, action)
-		}else{
-			updateUserOrder(productId, action)
-		}
+		queueCartUpdate(productId, action)
 	})
 }
 
-function addCookieItem(productId, action){
-	console.log('User is not authenticated')
+// Clicks are collected per product and sent as one batch once the user
+// pauses, instead of one request and a full page reload per click.
+var CART_DEBOUNCE_MS = 300
+var pendingCart = {}
+var cartTimer = null
+
+function queueCartUpdate(productId, action){
+	var delta = (action == 'add') ? 1 : -1
+	pendingCart[productId] = (pendingCart[productId] || 0) + delta
 
-	if (action == 'add'){
-		if (cart[productId] == undefined){
-		cart[productId] = {'quantity':1}
+	clearTimeout(cartTimer)
+	cartTimer = setTimeout(sendCartUpdates, CART_DEBOUNCE_MS)
+}
 
-		}else{
-			cart[productId]['quantity'] += 1
+function sendCartUpdates(){
+	var ops = []
+	for (var productId in pendingCart){
+		var delta = pendingCart[productId]
+		if (delta != 0){
+			ops.push({'productId':productId, 'action':(delta > 0) ? 'add' : 'remove', 'quantity':Math.abs(delta)})
 		}
 	}
+	pendingCart = {}
+	if (ops.length == 0){
+		return
+	}
 
-	if (action == 'remove'){
-		cart[productId]['quantity'] -= 1
+	// Guest carts live in a signed cookie that only the server writes, so
+	// anonymous and logged-in users go through the same endpoint.
+	fetch('/cart/update/', {
+		method:'POST',
+		headers:{
+			'Content-Type':'application/json',
+			'X-CSRFToken':csrftoken,
+		},
+		body:JSON.stringify({'ops':ops})
+	})
+	.then((response) => {
+	   return response.json();
+	})
+	.then((data) => {
+	    renderCart(data)
+	});
+}
 
-		if (cart[productId]['quantity'] <= 0){
-			console.log('Item should be deleted')
-			delete cart[productId];
-		}
+function setText(id, value){
+	var element = document.getElementById(id)
+	if (element){
+		element.textContent = value
 	}
-	console.log('CART:', cart)
-	document.cookie ='cart=' + JSON.stringify(cart) + ";domain=;path=/"
-
-	location.reload()
 }
 
-function updateUserOrder(productId, action){
-	console.log('User is authenticated, sending data...')
+function renderCart(data){
+	if (data.error){
+		console.log('Cart update failed:', data.error)
+		return
+	}
 
-		var url = '/update_item/'
+	setText('cart-total', data.cart.items)
+	setText('cart-items-count', data.cart.items)
+	setText('cart-total-amount', data.cart.total)
 
-		fetch(url, {
-			method:'POST',
-			headers:{
-				'Content-Type':'application/json',
-				'X-CSRFToken':csrftoken,
-			},
-			body:JSON.stringify({'productId':productId, 'action':action})
-		})
-		.then((response) => {
-		   return response.json();
-		})
-		.then((data) => {
-		    location.reload()
-		});
+	for (var i = 0; i < data.lines.length; i++){
+		var line = data.lines[i]
+		var row = document.querySelector('.cart-row[data-product="' + line.productId + '"]')
+		if (!row){
+			continue
+		}
+		if (line.quantity <= 0){
+			row.remove()
+			continue
+		}
+		row.querySelector('.line-quantity').textContent = line.quantity
+		row.querySelector('.line-total').textContent = line.total
+	}
 }
-
@@ -1,10 +1,153 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils import timezone
+from django.utils.functional import cached_property
 from .models import *
 
-# Register your models here.
-admin.site.register(Customer)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(OrderItem)
+
+class EstimatedCountPaginator(Paginator):
+    # COUNT(*) over a table with millions of rows takes seconds. Unfiltered
+    # changelists use the database's row estimate, filtered ones stop
+    # counting at COUNT_LIMIT.
+    COUNT_LIMIT = 10000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        if not query.where:
+            estimate = estimated_row_count(self.object_list.model)
+            if estimate is not None:
+                return estimate
+        return self.object_list.order_by().values('pk')[:self.COUNT_LIMIT].count()
+
+
+def estimated_row_count(model):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s', [table],
+            )
+        else:
+            # The largest rowid is an upper bound that is exact until rows
+            # are deleted, and is read straight off the primary key.
+            cursor.execute('SELECT MAX(%s) FROM %s' % (
+                connection.ops.quote_name(model._meta.pk.column), connection.ops.quote_name(table),
+            ))
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Newest first, walking the primary key index.
+    ordering = ('-id',)
+
+
+@admin.register(Customer)
+class CustomerAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'email', 'user')
+    list_select_related = ('user',)
+    search_fields = ('name', 'email')
+    raw_id_fields = ('user',)
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'sku', 'price', 'digital')
+    list_filter = ('digital',)
+    search_fields = ('name', 'sku')
+    ordering = ('-id',)
+
+
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    autocomplete_fields = ('product',)
+    extra = 0
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'customer', 'date_order', 'complete', 'transaction_id', 'item_count', 'total')
+    # Date ranges rather than date_hierarchy: the hierarchy's DISTINCT over
+    # truncated dates scans the whole table, these are index range scans.
+    list_filter = (('date_order', admin.DateFieldListFilter), 'complete')
+    list_select_related = ('customer',)
+    sortable_by = ('id', 'date_order')
+    ordering = ('-date_order', '-id')
+    search_fields = ('=transaction_id',)
+    raw_id_fields = ('customer',)
+    inlines = (OrderItemInline,)
+
+    def get_search_results(self, request, queryset, search_term):
+        # An order number is a primary key lookup, not a LIKE over the table.
+        if search_term.strip().isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def save_model(self, request, obj, form, change):
+        # Sales rollups pick up completed orders by completed_at, which
+        # checkout stamps; an order completed here needs it too.
+        if obj.complete and obj.completed_at is None:
+            obj.completed_at = timezone.now()
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        # Lines edited inline bypass the cart service that keeps the stored
+        # totals current.
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).recompute_totals()
+
+
+@admin.register(OrderItem)
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ('id', 'order', 'product', 'quantity', 'date_added')
+    list_select_related = ('order', 'product')
+    sortable_by = ('id',)
+    search_fields = ('=order__transaction_id',)
+    raw_id_fields = ('order',)
+    autocomplete_fields = ('product',)
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term.strip().isdigit():
+            return queryset.filter(order_id=int(search_term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        Order.objects.filter(pk__in=[obj.order_id, form.initial.get('order')]).recompute_totals()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        Order.objects.filter(pk=obj.order_id).recompute_totals()
+
+    def delete_queryset(self, request, queryset):
+        order_ids = list(queryset.values_list('order_id', flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        Order.objects.filter(pk__in=order_ids).recompute_totals()
+
+
 #admin.site.register(ShippingAddress)
-admin.site.register(UserAddress)
\ No newline at end of file
+@admin.register(UserAddress)
+class UserAddressAdmin(LargeTableAdmin):
+    list_display = ('id', 'username', 'email', 'city', 'state', 'pincode')
+    search_fields = ('username', 'email')
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('id', 'task', 'state', 'priority', 'attempts', 'available_at', 'created_at')
+    list_filter = ('state',)
+    search_fields = ('task',)
+    actions = ('retry_jobs',)
+
+    @admin.action(description='Retry selected failed jobs')
+    def retry_jobs(self, request, queryset):
+        queryset.filter(state=Job.FAILED).update(state=Job.QUEUED, attempts=0, available_at=timezone.now())
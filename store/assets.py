@@ -0,0 +1,141 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bundles listed in settings.ASSET_BUNDLES are concatenated, minified and
+# written to settings.ASSET_BUILD_DIR as <name>.<hash>.<ext> with .gz and .br
+# siblings, plus a manifest mapping bundle names to the built files. Until
+# `manage.py build_assets` has run, templates fall back to the source files.
+_manifest = {'mtime': None, 'bundles': {}, 'version': ''}
+
+
+def _manifest_path():
+    return os.path.join(settings.ASSET_BUILD_DIR, 'manifest.json')
+
+
+def load_manifest():
+    try:
+        mtime = os.stat(_manifest_path()).st_mtime
+    except OSError:
+        mtime = None
+    if mtime != _manifest['mtime']:
+        if mtime is None:
+            bundles, version = {}, ''
+        else:
+            with open(_manifest_path(), 'rb') as f:
+                data = f.read()
+            bundles, version = json.loads(data), hashlib.md5(data).hexdigest()[:8]
+        _manifest.update(mtime=mtime, bundles=bundles, version=version)
+    return _manifest
+
+
+def manifest_version():
+    return load_manifest()['version']
+
+
+def bundle_urls(name):
+    built = load_manifest()['bundles'].get(name)
+    if built:
+        return [static(built)]
+    return [static(source) for source in settings.ASSET_BUNDLES[name]]
+
+
+def bundle_tags(name):
+    urls = [(url,) for url in bundle_urls(name)]
+    if name.endswith('.js'):
+        return format_html_join('\n', '<script type="text/javascript" src="{}"></script>', urls)
+    return format_html_join('\n', '<link rel="stylesheet" href="{}">', urls)
+
+
+# Quoted strings and comments, matched together so that a "/*" inside a
+# string is not taken for a comment.
+CSS_STRINGS_AND_COMMENTS = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|/\*.*?\*/''', re.S)
+
+
+def minify_css(source):
+    # Strings are set aside while whitespace is squeezed, so values like
+    # content: "a  b" and url("my image.png") keep every character.
+    strings = []
+
+    def set_aside(match):
+        if match.group().startswith('/*'):
+            return ''
+        strings.append(match.group())
+        return '\0%d\0' % (len(strings) - 1)
+
+    source = CSS_STRINGS_AND_COMMENTS.sub(set_aside, source)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = re.sub(r':\s+', ':', source)
+    source = source.replace(';}', '}')
+    return re.sub(r'\0(\d+)\0', lambda match: strings[int(match.group(1))], source.strip())
+
+
+def minify_js(source):
+    # Conservative: drop indentation, blank lines and whole-line comments,
+    # but keep line breaks so automatic semicolon insertion still works.
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+def _find_source(path):
+    for directory in settings.STATICFILES_DIRS:
+        candidate = os.path.join(directory, path)
+        if os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError('Asset bundle source %r not found in STATICFILES_DIRS' % path)
+
+
+def build_bundle(name, sources):
+    parts = []
+    for path in sources:
+        with open(_find_source(path), encoding='utf-8') as f:
+            parts.append(f.read())
+
+    stem, ext = os.path.splitext(name)
+    minify = minify_js if ext == '.js' else minify_css
+    content = '\n'.join(minify(part) for part in parts).encode('utf-8')
+
+    digest = hashlib.md5(content).hexdigest()[:12]
+    filename = '%s.%s%s' % (stem, digest, ext)
+    path = os.path.join(settings.ASSET_BUILD_DIR, filename)
+    with open(path, 'wb') as f:
+        f.write(content)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(content))
+    return filename, len(content)
+
+
+def build_assets(clean=False):
+    os.makedirs(settings.ASSET_BUILD_DIR, exist_ok=True)
+    prefix = os.path.relpath(settings.ASSET_BUILD_DIR, settings.STATICFILES_DIRS[0]).replace(os.sep, '/')
+
+    manifest, sizes = {}, {}
+    for name, sources in settings.ASSET_BUNDLES.items():
+        filename, size = build_bundle(name, sources)
+        manifest[name] = '%s/%s' % (prefix, filename)
+        sizes[name] = size
+
+    if clean:
+        keep = {os.path.basename(path) for path in manifest.values()}
+        for filename in os.listdir(settings.ASSET_BUILD_DIR):
+            if filename != 'manifest.json' and re.sub(r'\.(gz|br)$', '', filename) not in keep:
+                os.remove(os.path.join(settings.ASSET_BUILD_DIR, filename))
+
+    with open(_manifest_path(), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest, sizes
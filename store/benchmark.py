@@ -0,0 +1,232 @@
+import itertools
+import platform
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from .catalog import bump_catalog_version
+from .models import Customer, Order, OrderItem, Product
+from .querycount import QueryRecorder
+from .search import fts_enabled, rebuild_index
+
+BENCH_USER_PREFIX = 'bench'
+BENCH_PASSWORD = 'bench-password'
+# 'testserver' is only allowed under the test runner.
+BENCH_HOST = 'localhost'
+SCENARIOS = ('store', 'cart', 'checkout', 'update_item', 'order_history', 'login')
+
+
+def _next_id(model):
+    last = model.objects.order_by('-id').values_list('id', flat=True).first()
+    return (last or 0) + 1
+
+
+def _insert(model, rows, batch_size):
+    # Insert a generator of unsaved instances in fixed-size batches without
+    # ever holding the whole set in memory.
+    rows = iter(rows)
+    total = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return total
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=batch_size)
+        total += len(batch)
+
+
+def seed(products=100000, customers=50000, orders=1000000, items_per_order=1,
+         cart_lines=5, batch_size=5000, seed=0, log=print):
+    """Bulk-load a synthetic catalog, customers and order history.
+
+    Every customer gets an open cart of ``cart_lines`` products and a share
+    of ``orders`` completed orders. Users are named ``bench<n>`` with the
+    password BENCH_PASSWORD.
+    """
+    rng = random.Random(seed)
+    first_product = _next_id(Product)
+    first_user = _next_id(User)
+    first_customer = _next_id(Customer)
+    first_order = _next_id(Order)
+
+    def product_rows():
+        for i in range(products):
+            price = rng.randint(50, 50000) / 10
+            yield Product(id=first_product + i, name='Bench product %d' % i, price=price,
+                          price_paise=Product.to_paise(price), digital=i % 10 == 0)
+
+    started = time.monotonic()
+    _insert(Product, product_rows(), batch_size)
+    log('products: %d (%.1fs)' % (products, time.monotonic() - started))
+
+    # Hashing 50k passwords would dominate the run; they all share one hash.
+    password = make_password(BENCH_PASSWORD)
+    started = time.monotonic()
+    _insert(User, (
+        User(id=first_user + i, username='%s%d' % (BENCH_USER_PREFIX, first_user + i), password=password)
+        for i in range(customers)
+    ), batch_size)
+    _insert(Customer, (
+        Customer(id=first_customer + i, user_id=first_user + i, name='Bench customer %d' % i)
+        for i in range(customers)
+    ), batch_size)
+    log('customers: %d (%.1fs)' % (customers, time.monotonic() - started))
+
+    def random_products(count):
+        return rng.sample(range(first_product, first_product + products), min(count, products))
+
+    started = time.monotonic()
+    # Ids are assigned up front so order items can reference them without
+    # reading the orders back.
+    _insert(Order, (
+        Order(id=first_order + i, customer_id=first_customer + i, complete=False)
+        for i in range(customers)
+    ), batch_size)
+    _insert(OrderItem, (
+        OrderItem(order_id=first_order + i, product_id=product_id, quantity=rng.randint(1, 3))
+        for i in range(customers) for product_id in random_products(cart_lines)
+    ), batch_size)
+
+    first_complete = first_order + customers
+    completed_at = timezone.now()
+    _insert(Order, (
+        Order(id=first_complete + i, customer_id=first_customer + rng.randrange(customers), complete=True,
+              completed_at=completed_at, transaction_id='bench-%d' % i)
+        for i in range(orders)
+    ), batch_size)
+    _insert(OrderItem, (
+        OrderItem(order_id=first_complete + i, product_id=product_id, quantity=rng.randint(1, 3))
+        for i in range(orders) for product_id in random_products(items_per_order)
+    ), batch_size)
+    # Their stored totals, which the cart service and checkout would have
+    # kept, from the lines just inserted.
+    Order.objects.filter(id__gte=first_order).recompute_totals()
+    log('orders: %d, order items: %d (%.1fs)' % (
+        customers + orders, customers * cart_lines + orders * items_per_order, time.monotonic() - started))
+
+    # bulk_create skips the signals that keep the search index and the
+    # cached catalog current.
+    if fts_enabled():
+        rebuild_index()
+    bump_catalog_version()
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class _Visitor:
+    # One simulated browser: its own test client, session and cart.
+    def __init__(self, username):
+        self.client = Client(SERVER_NAME=BENCH_HOST)
+        self.username = username
+        self.user = User.objects.get(username=username) if username else None
+        if self.user is not None:
+            self.client.force_login(self.user)
+        self.products = list(Product.objects.order_by('?').values_list('id', flat=True)[:20])
+        self.added = []
+
+    def request(self, scenario):
+        if scenario == 'update_item':
+            # Alternate adds and removes so the cart does not grow unbounded.
+            if self.added:
+                product, action = self.added.pop(), 'remove'
+            else:
+                product, action = random.choice(self.products), 'add'
+                self.added.append(product)
+            return self.client.post(reverse('update_item'), {'productId': product, 'action': action},
+                                    content_type='application/json')
+        if scenario == 'login':
+            client = Client(SERVER_NAME=BENCH_HOST)
+            return client.post(reverse('login'), {'username': self.username, 'password': BENCH_PASSWORD})
+        return self.client.get(reverse(scenario))
+
+
+def _bench_usernames(count):
+    return list(
+        User.objects.filter(username__startswith=BENCH_USER_PREFIX)
+        .order_by('?').values_list('username', flat=True)[:count]
+    )
+
+
+def run_scenario(scenario, requests=200, concurrency=4, warmup=10):
+    """Issue ``requests`` requests for one scenario from ``concurrency``
+    threads and return latency percentiles, throughput and query counts."""
+    anonymous = scenario == 'store'
+    usernames = [None] * concurrency if anonymous else _bench_usernames(concurrency)
+    if len(usernames) < concurrency:
+        raise ValueError('Not enough benchmark users; run seed_benchmark first.')
+
+    barrier = threading.Barrier(concurrency)
+    share = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+    def work(username, count):
+        try:
+            visitor = _Visitor(username)
+            for _ in range(warmup):
+                visitor.request(scenario)
+            latencies, queries, sql_time, errors = [], 0, 0.0, 0
+            barrier.wait()
+            started = time.perf_counter()
+            for _ in range(count):
+                with QueryRecorder() as recorder:
+                    began = time.perf_counter()
+                    response = visitor.request(scenario)
+                    latencies.append(time.perf_counter() - began)
+                queries += recorder.count
+                sql_time += recorder.total_time
+                errors += response.status_code >= 400
+            return latencies, queries, sql_time, errors, started, time.perf_counter()
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(work, usernames, share))
+
+    latencies = [latency for result in results for latency in result[0]]
+    total = len(latencies)
+    elapsed = max(result[5] for result in results) - min(result[4] for result in results)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': sum(result[3] for result in results),
+        'seconds': round(elapsed, 3),
+        'throughput': round(total / elapsed, 1) if elapsed else None,
+        'mean_ms': ms(statistics.fmean(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'queries_per_request': round(sum(result[1] for result in results) / total, 2) if total else None,
+        'sql_ms_per_request': ms(sum(result[2] for result in results) / total) if total else None,
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'debug': settings.DEBUG,
+        'products': Product.objects.count(),
+        'orders': Order.objects.count(),
+        'order_items': OrderItem.objects.count(),
+    }
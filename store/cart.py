@@ -0,0 +1,214 @@
+import decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+from .inventory import hold_cart_lines
+from .models import Customer, Order, OrderItem, Product
+from .utils import cookieCart, readCartCookie
+
+CART_ACTIONS = ('add', 'remove', 'set')
+
+
+class CartError(ValueError):
+    pass
+
+
+EMPTY_ORDER = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
+
+
+class Cart:
+    # The visitor's cart, attached to every request by CartMiddleware. Nothing
+    # is queried until a view or template reads it, each part is loaded at
+    # most once per request, and reading never creates an Order.
+    def __init__(self, request):
+        self.request = request
+
+    @property
+    def is_guest(self):
+        return not self.request.user.is_authenticated
+
+    @cached_property
+    def _cookie_cart(self):
+        return cookieCart(self.request)
+
+    @cached_property
+    def order(self):
+        if self.is_guest:
+            return self._cookie_cart['order']
+        order = (
+            Order.objects.filter(customer__user=self.request.user, complete=False)
+            .order_by('id').first()
+        )
+        return order or EMPTY_ORDER
+
+    @cached_property
+    def items(self):
+        if self.is_guest:
+            return self._cookie_cart['items']
+        if self.order is EMPTY_ORDER:
+            return []
+        return list(self.order.orderitem_set.select_related('product'))
+
+    @cached_property
+    def count(self):
+        if self.is_guest:
+            return self._cookie_cart['cartItems']
+        if 'order' in self.__dict__:
+            return 0 if self.order is EMPTY_ORDER else self.order.get_cart_items
+        # The navbar badge alone reads one stored column.
+        return Order.objects.filter(
+            customer__user=self.request.user, complete=False,
+        ).order_by('id').values_list('item_count', flat=True).first() or 0
+
+
+def customer_for(user):
+    customer = getattr(user, 'customer', None)
+    if customer is None:
+        customer, created = Customer.objects.get_or_create(
+            user=user, defaults={'name': user.username, 'email': user.email},
+        )
+    return customer
+
+
+def parse_cart_ops(ops):
+    # Collapse a batch of operations into one change per product, either
+    # ('delta', n) or ('set', n), applied in the order they were sent.
+    if not isinstance(ops, list) or not ops:
+        raise CartError('ops must be a non-empty list')
+
+    changes = {}
+    for op in ops:
+        try:
+            product_id = int(op['productId'])
+            action = op['action']
+            quantity = int(op.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise CartError('Invalid cart operation: %r' % (op,))
+        if action not in CART_ACTIONS or quantity < 0:
+            raise CartError('Invalid cart operation: %r' % (op,))
+
+        mode, current = changes.get(product_id, ('delta', 0))
+        if action == 'set':
+            changes[product_id] = ('set', quantity)
+        elif action == 'add':
+            changes[product_id] = (mode, current + quantity)
+        else:
+            changes[product_id] = (mode, current - quantity)
+    return changes
+
+
+def _upsert_line(order, product_id, mode, quantity):
+    lines = OrderItem.objects.filter(order=order, product_id=product_id)
+    value = quantity if mode == 'set' else F('quantity') + quantity
+    if lines.update(quantity=value) or quantity <= 0:
+        return
+    try:
+        with transaction.atomic():
+            OrderItem.objects.create(order=order, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        # A concurrent request created the line first.
+        lines.update(quantity=value)
+
+
+def update_order_cart(customer, changes):
+    products = Product.objects.in_bulk(list(changes))
+    product_ids = list(products)
+
+    # Removing from, or naming unknown products in, a cart that does not
+    # exist yet must not create an empty order.
+    adds = any(quantity > 0 for product_id, (mode, quantity) in changes.items() if product_id in products)
+    with transaction.atomic():
+        if adds:
+            order, created = Order.objects.select_for_update().get_or_create(customer=customer, complete=False)
+        else:
+            order = (
+                Order.objects.select_for_update()
+                .filter(customer=customer, complete=False).order_by('id').first()
+            )
+            if order is None:
+                return {
+                    'lines': [{'productId': product_id, 'quantity': 0, 'total': 0} for product_id in changes],
+                    'cart': {'items': 0, 'total': 0, 'shipping': False},
+                }
+        before = dict(OrderItem.objects.filter(order=order, product_id__in=product_ids).values_list('product_id', 'quantity'))
+        for product_id, (mode, quantity) in changes.items():
+            if product_id in products:
+                _upsert_line(order, product_id, mode, quantity)
+        OrderItem.objects.filter(order=order, product_id__in=product_ids, quantity__lte=0).delete()
+        quantities = dict(
+            OrderItem.objects.filter(order=order, product_id__in=product_ids).values_list('product_id', 'quantity')
+        )
+
+        # The order row is locked, so its stored totals plus these deltas
+        # are exact.
+        items_delta = paise_delta = 0
+        for product_id, product in products.items():
+            change = quantities.get(product_id, 0) - (before.get(product_id) or 0)
+            items_delta += change
+            paise_delta += change * (product.price_paise or 0)
+        if items_delta or paise_delta:
+            Order.objects.filter(pk=order.pk).update(
+                item_count=F('item_count') + items_delta,
+                total=Coalesce(F('total'), Value(0)) + Value(decimal.Decimal(paise_delta) / 100),
+            )
+            order.item_count += items_delta
+            order.total = (order.total or 0) + decimal.Decimal(paise_delta) / 100
+
+        short = hold_cart_lines(order, {product_id: quantities.get(product_id, 0) for product_id in products})
+
+    lines = []
+    for product_id in changes:
+        quantity = quantities.get(product_id, 0)
+        price = products[product_id].price_in_rupees if product_id in products else 0
+        line = {'productId': product_id, 'quantity': quantity, 'total': price * quantity}
+        if product_id in short:
+            # More than is in stock; checkout will refuse the cart as is.
+            line['available'] = short[product_id]
+        lines.append(line)
+
+    return {
+        'lines': lines,
+        'cart': {
+            'items': order.item_count,
+            'total': order.get_cart_total,
+            'shipping': order.shipping,
+        },
+    }
+
+
+def update_cookie_cart(request, changes):
+    cart = dict(readCartCookie(request))
+    for product_id, (mode, quantity) in changes.items():
+        if mode == 'delta':
+            quantity += cart.get(product_id, 0)
+        if quantity > 0:
+            cart[product_id] = quantity
+        else:
+            cart.pop(product_id, None)
+
+    data = cookieCart(request, cart)
+    items = {item['id']: item for item in data['items']}
+    # Drop products that no longer exist so the cookie does not keep them.
+    cart = {product_id: quantity for product_id, quantity in cart.items() if product_id in items}
+
+    lines = []
+    for product_id in changes:
+        item = items.get(product_id)
+        lines.append({
+            'productId': product_id,
+            'quantity': item['quantity'] if item else 0,
+            'total': item['get_total'] if item else 0,
+        })
+
+    order = data['order']
+    return cart, {
+        'lines': lines,
+        'cart': {
+            'items': order['get_cart_items'],
+            'total': order['get_cart_total'],
+            'shipping': order['shipping'],
+        },
+    }
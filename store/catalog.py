@@ -0,0 +1,110 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template
+
+from .assets import manifest_version
+from .models import Product
+
+# Storefront product rows, serialized once per catalog version. The version
+# counter lives in the shared cache so every worker sees a bump; the rows are
+# also held in this process so a hit costs one cache lookup and no queries.
+VERSION_KEY = 'store:catalog:version'
+ROWS_KEY = 'store:catalog:rows:%s'
+
+STOREFRONT_TEMPLATES = (
+    'store/navbar.html', 'store/store.html', 'store/main.html', 'store/product_grid.html',
+)
+
+_local = {'version': None, 'rows': None}
+
+
+def _cache():
+    return caches[getattr(settings, 'STORE_CATALOG_CACHE', 'default')]
+
+
+def catalog_version():
+    cache = _cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a cold cache never reuses a stale version.
+        version = int(time.time())
+        if not cache.add(VERSION_KEY, version, None):
+            version = cache.get(VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    cache = _cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, int(time.time()), None)
+
+
+@functools.lru_cache(maxsize=None)
+def _templates_digest():
+    # Cached storefront HTML must not outlive a deploy that changes templates.
+    digest = hashlib.md5()
+    for name in STOREFRONT_TEMPLATES:
+        digest.update(get_template(name).template.source.encode())
+    return digest.hexdigest()[:8]
+
+
+def storefront_version():
+    return '%s-%s%s' % (catalog_version(), _templates_digest(), manifest_version())
+
+
+def serialize_product(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'price': product.price,
+        'price_paise': product.price_paise,
+        'price_in_rupees': product.price_in_rupees,
+        'digital': product.digital,
+        'imageURL': product.imageURL,
+        'thumbnailURL': product.thumbnailURL,
+        'cardURL': product.cardURL,
+        'jpegSrcset': product.jpegSrcset,
+        'webpSrcset': product.webpSrcset,
+    }
+
+
+def get_catalog():
+    version = catalog_version()
+    if _local['version'] == version:
+        return _local['rows']
+
+    cache = _cache()
+    rows = cache.get(ROWS_KEY % version)
+    if rows is None:
+        rows = [serialize_product(product) for product in Product.objects.order_by('id')]
+        cache.set(ROWS_KEY % version, rows, getattr(settings, 'STORE_CATALOG_TIMEOUT', None))
+
+    _local['version'], _local['rows'] = version, rows
+    return rows
+
+
+# Sort keys for the catalog listing; each is backed by a (column, id) index.
+CATALOG_SORTS = {
+    'price': ('price_paise', 'id'),
+    '-price': ('-price_paise', '-id'),
+    'name': ('name', 'id'),
+    '-name': ('-name', '-id'),
+}
+
+
+def catalog_page(min_price=None, max_price=None, sort='name', page=1, page_size=24):
+    products = Product.objects.all()
+    if min_price is not None:
+        products = products.filter(price_paise__gte=min_price * 100)
+    if max_price is not None:
+        products = products.filter(price_paise__lte=max_price * 100)
+
+    offset = (page - 1) * page_size
+    rows = [serialize_product(product) for product in products.order_by(*CATALOG_SORTS[sort])[offset:offset + page_size + 1]]
+    return rows[:page_size], len(rows) > page_size
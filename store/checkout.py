@@ -0,0 +1,117 @@
+import decimal
+import uuid
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .inventory import OutOfStock, commit_order_stock
+from .models import Order, OrderItem, UserAddress
+from .utils import guestOrder
+
+PAYMENT_METHODS = ('cod',)
+REQUIRED_FIELDS = ('name', 'email')
+ADDRESS_FIELDS = ('street', 'city', 'state', 'pincode')
+
+
+class CheckoutError(ValueError):
+    pass
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def clean_checkout_form(data):
+    form = {field: (data.get(field) or '').strip() for field in REQUIRED_FIELDS + ADDRESS_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if not form[field]]
+    if missing:
+        raise CheckoutError('Please fill in: %s' % ', '.join(missing))
+    form['payment_method'] = data.get('payment_method') or PAYMENT_METHODS[0]
+    if form['payment_method'] not in PAYMENT_METHODS:
+        raise CheckoutError('Unsupported payment method')
+
+    key = (data.get('idempotency_key') or '').strip()
+    if not key or len(key) > 64:
+        raise CheckoutError('Your checkout form has expired, please try again')
+    form['idempotency_key'] = key
+    return form
+
+
+def _finalize(order, items, form):
+    # Snapshot each line's price, then complete the order with a conditional
+    # UPDATE so that of two concurrent submits only one can win.
+    for item in items:
+        item.price_paise = item.product.price_paise
+    OrderItem.objects.bulk_update(items, ['price_paise'])
+
+    total = decimal.Decimal(sum(item.price_paise * item.quantity for item in items)) / 100
+    values = {
+        'complete': True,
+        'completed_at': timezone.now(),
+        'transaction_id': uuid.uuid4().hex,
+        'idempotency_key': form['idempotency_key'],
+        'payment_method': form['payment_method'],
+        'total': total,
+        'item_count': sum(item.quantity for item in items),
+        'name': form['name'],
+        'email': form['email'],
+        'address': form['street'],
+        'city': form['city'],
+        'state': form['state'],
+        'zipcode': form['pincode'][:10],
+    }
+    if not Order.objects.filter(pk=order.pk, complete=False).update(**values):
+        transaction.set_rollback(True)
+        return None
+    for field, value in values.items():
+        setattr(order, field, value)
+
+    UserAddress.objects.create(
+        username=form['name'], email=form['email'], street=form['street'],
+        city=form['city'], state=form['state'], pincode=form['pincode'][:10],
+    )
+    return order
+
+
+def place_order(request, form):
+    """Complete the visitor's cart as an order and return (order, created).
+
+    Everything happens in one transaction with the open order locked. A
+    repeated idempotency key returns the order it already placed.
+    """
+    placed = Order.objects.filter(idempotency_key=form['idempotency_key']).first()
+    if placed is not None:
+        return placed, False
+
+    try:
+        with transaction.atomic():
+            if request.user.is_authenticated:
+                order = (
+                    Order.objects.select_for_update(of=('self',))
+                    .filter(customer__user=request.user, complete=False).order_by('id').first()
+                )
+                items = list(order.orderitem_set.select_related('product')) if order else []
+            else:
+                customer, order, items = guestOrder(request, {'form': form})
+
+            items = [item for item in items if item.product is not None and item.quantity]
+            if not items:
+                raise CheckoutError('Your cart is empty')
+
+            try:
+                commit_order_stock(order, items)
+            except OutOfStock as e:
+                name = next(item.product.name for item in items if item.product_id == e.product_id)
+                raise CheckoutError('Sorry, only %d of %s left in stock' % (e.available, name))
+
+            placed = _finalize(order, items, form)
+    except IntegrityError:
+        placed = None
+
+    if placed is None:
+        # Lost the race to a concurrent submit of the same form.
+        placed = Order.objects.filter(idempotency_key=form['idempotency_key']).first()
+        if placed is None:
+            raise CheckoutError('Your order could not be placed, please try again')
+        return placed, False
+    return placed, True
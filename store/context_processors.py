@@ -0,0 +1,9 @@
+from django.utils.functional import SimpleLazyObject
+
+
+def cart(request):
+    # Lazy so pages that never show the cart badge never query for it.
+    cart = getattr(request, 'cart', None)
+    if cart is None:
+        return {}
+    return {'cart': cart, 'cartItems': SimpleLazyObject(lambda: cart.count)}
@@ -0,0 +1,61 @@
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+logger = logging.getLogger(__name__)
+
+# Applied to every new SQLite connection (see store.signals). WAL lets readers
+# run alongside the single writer, and busy_timeout makes writers wait for the
+# lock instead of failing straight away.
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_pragmas():
+    # settings.SQLITE_PRAGMAS only lists what differs from the defaults.
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {}))
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+def configure_sqlite(connection):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+def is_locked_error(error):
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+
+def retry_on_locked(view=None, attempts=4, delay=0.05):
+    # SQLite reports "database is locked" without waiting when a read
+    # transaction tries to upgrade to a write while another writer holds the
+    # lock, so write views retry a few times with jittered backoff.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            for attempt in range(attempts):
+                try:
+                    return view(request, *args, **kwargs)
+                except OperationalError as e:
+                    if not is_locked_error(e) or connection.in_atomic_block or attempt == attempts - 1:
+                        raise
+                    logger.warning('Retrying %s after "%s" (attempt %d)', view.__name__, e, attempt + 1)
+                    time.sleep(delay * (2 ** attempt) * (1 + random.random()))
+        return wrapper
+
+    if view is not None:
+        return decorator(view)
+    return decorator
@@ -0,0 +1,138 @@
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Order, OrderItem
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_CHUNK_SIZE = 2000
+CSV_COLUMNS = (
+    'order_id', 'transaction_id', 'date_order', 'complete', 'customer_id', 'customer_name', 'email',
+    'product_id', 'sku', 'product_name', 'quantity', 'unit_price', 'line_total', 'order_items', 'order_total',
+)
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_export_date(value, name):
+    if not value:
+        return None
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ExportError('%s must be a date in YYYY-MM-DD form' % name)
+    return date
+
+
+def _day_start(date):
+    # Compare against datetimes rather than date_order__date so the
+    # filter can use the index on date_order.
+    start = datetime.datetime.combine(date, datetime.time.min)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def export_queryset(since=None, until=None, complete=None):
+    # Orders placed on or after `since` and on or before `until` (dates),
+    # with customer and line items loaded in a fixed number of queries per
+    # chunk.
+    orders = Order.objects.select_related('customer').prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product').order_by('id')),
+    ).order_by('id')
+    if since is not None:
+        orders = orders.filter(date_order__gte=_day_start(since))
+    if until is not None:
+        orders = orders.filter(date_order__lt=_day_start(until + datetime.timedelta(days=1)))
+    if complete is not None:
+        orders = orders.filter(complete=complete)
+    return orders
+
+
+def iter_orders(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    # iterator() with a chunk size keeps the prefetch working while only one
+    # chunk of orders is ever held in memory.
+    for order in orders.iterator(chunk_size=chunk_size):
+        items = list(order.orderitem_set.all())
+        yield order, items, {
+            'items': sum(item.quantity or 0 for item in items),
+            'total': sum(_line_total(item) or 0 for item in items),
+        }
+
+
+def _unit_price(item):
+    # Lines whose product was deleted only have a price once placed.
+    if item.price_paise is None and item.product is None:
+        return None
+    return item.unit_price
+
+
+def _line_total(item):
+    unit_price = _unit_price(item)
+    return None if unit_price is None else unit_price * (item.quantity or 0)
+
+
+def _order_fields(order):
+    customer = order.customer
+    return {
+        'order_id': order.id,
+        'transaction_id': order.transaction_id or '',
+        'date_order': order.date_order.isoformat(),
+        'complete': bool(order.complete),
+        'customer_id': order.customer_id,
+        'customer_name': order.name or (customer.name if customer else '') or '',
+        'email': order.email or (customer.email if customer else '') or '',
+    }
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line straight back.
+    def write(self, value):
+        return value
+
+
+def csv_lines(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order, items, totals in iter_orders(orders, chunk_size):
+        fields = _order_fields(order)
+        for item in items or [None]:
+            product = item.product if item else None
+            row = dict(fields, order_items=totals['items'], order_total=totals['total'])
+            if item is not None:
+                row.update(
+                    product_id=item.product_id,
+                    sku=product.sku if product else '',
+                    product_name=product.name if product else '',
+                    quantity=item.quantity,
+                    unit_price=_unit_price(item),
+                    line_total=_line_total(item),
+                )
+            yield writer.writerow([row.get(column, '') for column in CSV_COLUMNS])
+
+
+def jsonl_lines(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    for order, items, totals in iter_orders(orders, chunk_size):
+        record = _order_fields(order)
+        record['items'] = [{
+            'product_id': item.product_id,
+            'sku': item.product.sku if item.product else None,
+            'product_name': item.product.name if item.product else None,
+            'quantity': item.quantity,
+            'unit_price': _unit_price(item),
+            'line_total': _line_total(item),
+        } for item in items]
+        record['order_items'] = totals['items']
+        record['order_total'] = totals['total']
+        yield json.dumps(record) + '\n'
+
+
+def export_lines(fmt, orders, chunk_size=EXPORT_CHUNK_SIZE):
+    return (csv_lines if fmt == 'csv' else jsonl_lines)(orders, chunk_size)
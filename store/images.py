@@ -0,0 +1,83 @@
+import hashlib
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from .jobs import task
+
+# Fixed-size derivatives of Product.image, bounded by the longest side in
+# pixels. Each one is written as WebP and JPEG under a content-hashed name,
+# so the files can be cached forever.
+IMAGE_VARIANTS = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 1200,
+}
+
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+DERIVATIVES_DIR = 'derivatives'
+
+
+def _open_rgb(name):
+    with default_storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(name):
+    # Plain function of the source file name so it can run in a worker
+    # process; the caller stores the returned mapping on the product.
+    image = _open_rgb(name)
+    stem = os.path.splitext(os.path.basename(name))[0]
+
+    variants = {'source': name}
+    for variant, size in IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        entry = {'width': resized.width, 'height': resized.height}
+
+        for ext, (fmt, options) in IMAGE_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, fmt, **options)
+            data = buffer.getvalue()
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            path = '%s/%s-%s.%s.%s' % (DERIVATIVES_DIR, stem, variant, digest, 'jpg' if ext == 'jpeg' else ext)
+            if not default_storage.exists(path):
+                default_storage.save(path, ContentFile(data))
+            entry[ext] = path
+
+        variants[variant] = entry
+    return variants
+
+
+def needs_variants(product):
+    source = product.image.name if product.image else ''
+    return (product.image_variants or {}).get('source', '') != source
+
+
+@task(timeout=600)
+def generate_product_variants(product_id, force=False):
+    from .catalog import bump_catalog_version
+    from .models import Product
+
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None or not (force or needs_variants(product)):
+        return
+
+    variants = render_variants(product.image.name) if product.image else {}
+    Product.objects.filter(pk=product.pk).update(image_variants=variants)
+    bump_catalog_version()
@@ -0,0 +1,128 @@
+import csv
+import io
+import itertools
+import json
+
+from django.db import transaction
+
+from .models import Order, Product
+from .search import index_products
+
+IMPORT_FIELDS = ('name', 'price', 'price_paise', 'digital', 'image')
+TRUE_VALUES = ('1', 'true', 'yes', 'y')
+FALSE_VALUES = ('', '0', 'false', 'no', 'n')
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(stream, fmt):
+    # Yield (line number, dict) pairs one at a time from a CSV or JSONL file.
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, RowError('invalid JSON: %s' % e)
+            continue
+        yield line_num, row if isinstance(row, dict) else RowError('expected a JSON object')
+
+
+def open_catalog(path, fmt=None):
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    return io.open(path, newline='' if fmt == 'csv' else None, encoding='utf-8-sig'), fmt
+
+
+def clean_row(row):
+    if isinstance(row, RowError):
+        raise row
+
+    sku = str(row.get('sku') or '').strip()
+    if not sku:
+        raise RowError('missing sku')
+    if len(sku) > 64:
+        raise RowError('sku longer than 64 characters')
+
+    name = str(row.get('name') or '').strip()
+    if not name:
+        raise RowError('missing name')
+
+    try:
+        price = float(row.get('price'))
+    except (TypeError, ValueError):
+        raise RowError('invalid price %r' % row.get('price'))
+    if price < 0 or price != price:
+        raise RowError('invalid price %r' % row.get('price'))
+
+    digital = row.get('digital', False)
+    if not isinstance(digital, bool):
+        digital = str(digital).strip().lower()
+        if digital not in TRUE_VALUES + FALSE_VALUES:
+            raise RowError('invalid digital flag %r' % row.get('digital'))
+        digital = digital in TRUE_VALUES
+
+    return {
+        'sku': sku,
+        'name': name[:200],
+        'price': price,
+        'price_paise': Product.to_paise(price),
+        'digital': digital,
+        'image': str(row.get('image') or '').strip(),
+    }
+
+
+def _current(product, field):
+    value = getattr(product, field)
+    return (value.name or '') if field == 'image' else value
+
+
+def chunks(iterable, size):
+    iterable = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterable, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def upsert_products(rows, batch_size=1000):
+    """Create or update the products for one chunk of cleaned rows, matched
+    on sku. Returns (created, updated, products whose image changed).
+
+    bulk_create and bulk_update skip Product.save() and the signals, so
+    price_paise comes from clean_row and the search index and open cart
+    totals are updated here; the caller bumps the catalog version once at
+    the end.
+    """
+    rows = {row['sku']: row for row in rows}  # the last row for a sku wins
+    with transaction.atomic():
+        existing = Product.objects.in_bulk(list(rows), field_name='sku')
+
+        new, changed = [], []
+        for sku, row in rows.items():
+            product = existing.get(sku)
+            if product is None:
+                new.append(Product(**row))
+                continue
+            if any(_current(product, field) != row[field] for field in IMPORT_FIELDS):
+                for field in IMPORT_FIELDS:
+                    setattr(product, field, row[field])
+                changed.append(product)
+
+        Product.objects.bulk_create(new, batch_size=batch_size)
+        Product.objects.bulk_update(changed, IMPORT_FIELDS, batch_size=batch_size)
+        index_products(new + changed)
+        if changed:
+            Order.objects.filter(complete=False, orderitem__product__in=changed).recompute_totals()
+
+    images = [product for product in new + changed if product.image and
+              product.image.name != (product.image_variants or {}).get('source')]
+    return len(new), len(changed), images
@@ -0,0 +1,236 @@
+import datetime
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+
+from .db import retry_on_locked
+from .models import Reservation, StockBucket
+
+# Stock for a product is spread over STOCK_BUCKETS StockBucket rows. A buyer
+# starts at a random bucket and takes stock with a conditional UPDATE
+# (quantity >= n), so parallel buyers of one product rarely touch the same
+# row and a bucket can never go negative. Products without buckets are not
+# stock tracked.
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id, requested, available):
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+        super().__init__('Product %s: %d requested, %d available' % (product_id, requested, available))
+
+
+def default_buckets():
+    return getattr(settings, 'STOCK_BUCKETS', 8)
+
+
+def hold_ttl():
+    return datetime.timedelta(seconds=getattr(settings, 'STOCK_HOLD_SECONDS', 15 * 60))
+
+
+def set_stock(product, quantity, buckets=None):
+    """Set the product's stock on hand to ``quantity``. Stock held for carts
+    is part of it, so only the rest goes into the buckets."""
+    buckets = buckets or default_buckets()
+    with transaction.atomic():
+        # Deleting first takes the write lock, so no hold can be taken
+        # between reading what is held and refilling the buckets.
+        StockBucket.objects.filter(product=product).delete()
+        holds = Reservation.objects.filter(product=product, state=Reservation.HELD).aggregate(
+            held=Sum('quantity'), last_bucket=Max('bucket'),
+        )
+        held = holds['held'] or 0
+        if held > quantity:
+            raise ValueError('%d of product %s is held in carts; cannot set its stock to %d'
+                             % (held, product.pk, quantity))
+        if holds['last_bucket'] is not None:
+            # Released holds go back to the bucket they came from.
+            buckets = max(buckets, holds['last_bucket'] + 1)
+        share, extra = divmod(quantity - held, buckets)
+        StockBucket.objects.bulk_create([
+            StockBucket(product=product, bucket=i, quantity=share + (i < extra)) for i in range(buckets)
+        ])
+
+
+def available(product):
+    return StockBucket.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def tracked_products(product_ids):
+    return set(
+        StockBucket.objects.filter(product__in=product_ids).values_list('product_id', flat=True).distinct()
+    )
+
+
+def _take(product_id, bucket, quantity):
+    return StockBucket.objects.filter(
+        product_id=product_id, bucket=bucket, quantity__gte=quantity,
+    ).update(quantity=F('quantity') - quantity)
+
+
+@retry_on_locked(attempts=8, delay=0.01)
+def reserve(product_id, quantity, order=None, ttl=None):
+    """Hold ``quantity`` of a product until ``ttl`` passes and return the
+    Reservation rows (one per bucket drawn from), or raise OutOfStock."""
+    expires_at = timezone.now() + (ttl or hold_ttl())
+    # The levels read here only pick which buckets to try; the conditional
+    # UPDATEs decide. Reading outside the transaction lets SQLite start it
+    # with a write, which waits for the lock instead of failing to upgrade.
+    buckets = list(StockBucket.objects.filter(product_id=product_id).values_list('bucket', 'quantity'))
+    start = random.randrange(len(buckets)) if buckets else 0
+    buckets = buckets[start:] + buckets[:start]
+
+    with transaction.atomic():
+        # Usually one bucket covers the whole quantity.
+        for bucket, stocked in buckets:
+            if stocked >= quantity and _take(product_id, bucket, quantity):
+                return [Reservation.objects.create(
+                    product_id=product_id, order=order, bucket=bucket, quantity=quantity, expires_at=expires_at,
+                )]
+
+        # Otherwise gather it from several; the transaction puts everything
+        # back if the total falls short. A bucket that changed since it was
+        # read refuses its UPDATE, so a pass that falls short reads the levels
+        # again, and gives up only once they add up to too little.
+        taken, remaining = defaultdict(int), quantity
+        while True:
+            for bucket, stocked in buckets:
+                amount = min(stocked, remaining)
+                if amount and _take(product_id, bucket, amount):
+                    taken[bucket] += amount
+                    remaining -= amount
+                if not remaining:
+                    break
+            if not remaining:
+                break
+            buckets = list(StockBucket.objects.filter(product_id=product_id).values_list('bucket', 'quantity'))
+            left = sum(stocked for _, stocked in buckets)
+            if left < remaining:
+                raise OutOfStock(product_id, quantity, quantity - remaining + left)
+
+        return Reservation.objects.bulk_create([
+            Reservation(product_id=product_id, order=order, bucket=bucket, quantity=amount, expires_at=expires_at)
+            for bucket, amount in taken.items()
+        ])
+
+
+def _restock(reservations):
+    # One UPDATE per (product, bucket) however many holds are returned.
+    returned = defaultdict(int)
+    for reservation in reservations:
+        returned[reservation.product_id, reservation.bucket] += reservation.quantity
+    for (product_id, bucket), quantity in returned.items():
+        StockBucket.objects.filter(product_id=product_id, bucket=bucket).update(quantity=F('quantity') + quantity)
+
+
+def release(reservations):
+    with transaction.atomic():
+        # Only holds still in HELD are returned, so a hold released by the
+        # sweeper and by its owner at the same time is restocked once.
+        released = [
+            reservation for reservation in reservations
+            if Reservation.objects.filter(pk=reservation.pk, state=Reservation.HELD).update(state=Reservation.RELEASED)
+        ]
+        _restock(released)
+    return len(released)
+
+
+def release_expired(now=None, batch_size=500):
+    """Return the stock of holds that expired before ``now``. Returns the
+    number released."""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        batch = list(
+            Reservation.objects.filter(state=Reservation.HELD, expires_at__lt=now)
+            .order_by('expires_at')[:batch_size]
+        )
+        if not batch:
+            return total
+        total += release(batch)
+
+
+def _give_back(holds, quantity):
+    # Return ``quantity`` of the stock in ``holds``, newest hold first; the
+    # last hold touched keeps whatever it has left over.
+    returned = []
+    for hold in sorted(holds, key=lambda hold: hold.pk, reverse=True):
+        if not quantity:
+            break
+        amount = min(hold.quantity, quantity)
+        current = Reservation.objects.filter(pk=hold.pk, state=Reservation.HELD, quantity=hold.quantity)
+        if amount == hold.quantity:
+            updated = current.update(state=Reservation.RELEASED)
+        else:
+            updated = current.update(quantity=hold.quantity - amount)
+        if updated:
+            returned.append(Reservation(product_id=hold.product_id, bucket=hold.bucket, quantity=amount))
+            quantity -= amount
+    _restock(returned)
+
+
+def hold_cart_lines(order, quantities):
+    """Make the order's holds match ``quantities`` ({product_id: quantity})
+    for stock-tracked products. Call inside the cart update's transaction.
+    Returns {product_id: available} for lines that could not be held in
+    full; those keep what they held before and checkout rejects them."""
+    short = {}
+    tracked = tracked_products(list(quantities))
+    for product_id in tracked:
+        holds = list(
+            Reservation.objects.select_for_update()
+            .filter(order=order, state=Reservation.HELD, product_id=product_id)
+        )
+        held = sum(hold.quantity for hold in holds)
+        wanted = quantities[product_id]
+        if wanted < held:
+            _give_back(holds, held - wanted)
+        elif wanted > held:
+            try:
+                reserve(product_id, wanted - held, order=order)
+            except OutOfStock as e:
+                short[product_id] = held + e.available
+    return short
+
+
+def commit_order_stock(order, items):
+    """Turn the order's holds into sold stock, reserving whatever its lines
+    need beyond what is already held. Call inside the checkout transaction;
+    raises OutOfStock and leaves the rollback to the caller."""
+    needed = defaultdict(int)
+    for item in items:
+        needed[item.product_id] += item.quantity
+    tracked = tracked_products(list(needed))
+    if not tracked:
+        return
+
+    for product_id in tracked:
+        holds = list(
+            Reservation.objects.select_for_update()
+            .filter(order=order, state=Reservation.HELD, product_id=product_id)
+        )
+        held = sum(hold.quantity for hold in holds)
+        if needed[product_id] > held:
+            reserve(product_id, needed[product_id] - held, order=order)
+        elif held > needed[product_id]:
+            # The cart shrank after the stock was held.
+            _give_back(holds, held - needed[product_id])
+
+    Reservation.objects.filter(order=order, state=Reservation.HELD).update(state=Reservation.COMMITTED)
+
+    # A hold the sweeper released after it was read above was not
+    # committed; take its stock again.
+    committed = dict(
+        Reservation.objects.filter(order=order, state=Reservation.COMMITTED, product__in=tracked)
+        .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+    for product_id in tracked:
+        shortfall = needed[product_id] - committed.get(product_id, 0)
+        if shortfall > 0:
+            holds = reserve(product_id, shortfall, order=order)
+            Reservation.objects.filter(pk__in=[hold.pk for hold in holds]).update(state=Reservation.COMMITTED)
@@ -0,0 +1,142 @@
+import datetime
+import functools
+import logging
+import traceback
+import uuid
+
+import django
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# A job queue in the store's own database. Functions decorated with @task
+# get an .enqueue() that inserts a Job row; run_worker claims rows with a
+# conditional UPDATE and runs them on a thread or process pool. Enqueued
+# inside a transaction, a job only becomes visible to workers if that
+# transaction commits.
+TASKS = {}
+
+
+def task(func=None, *, priority=0, max_attempts=3, timeout=300):
+    """Register ``func`` as a job. ``timeout`` is the lease in seconds; a
+    job still running after that may be handed to another worker."""
+    def decorator(func):
+        func.task_name = '%s.%s' % (func.__module__, func.__qualname__)
+        func.task_options = {'priority': priority, 'max_attempts': max_attempts, 'timeout': timeout}
+        func.enqueue = functools.partial(enqueue, func)
+        TASKS[func.task_name] = func
+        return func
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def eager():
+    return getattr(settings, 'STORE_JOBS_EAGER', False)
+
+
+def enqueue(func, *args, priority=None, delay=0, **kwargs):
+    """Queue ``func(*args, **kwargs)``; arguments must be JSON serializable.
+    With STORE_JOBS_EAGER the call runs in-process once the current
+    transaction commits and no Job row is written."""
+    if eager():
+        transaction.on_commit(lambda: func(*args, **kwargs))
+        return None
+    options = func.task_options
+    return Job.objects.create(
+        task=func.task_name,
+        args=list(args),
+        kwargs=kwargs,
+        priority=options['priority'] if priority is None else priority,
+        available_at=timezone.now() + datetime.timedelta(seconds=delay),
+        timeout=options['timeout'],
+        max_attempts=options['max_attempts'],
+    )
+
+
+def resolve(name):
+    if name not in TASKS:
+        # Importing the module registers its tasks.
+        import_string(name)
+    return TASKS[name]
+
+
+def retry_delay(attempts):
+    return datetime.timedelta(seconds=min(10 * 2 ** (attempts - 1), 3600))
+
+
+def claim(limit, now=None):
+    """Lease up to ``limit`` due jobs, most urgent first, and return
+    (id, lease token) pairs. Each is taken with an UPDATE conditional on the
+    row being as it was read, so two workers never run the same attempt."""
+    now = now or timezone.now()
+    candidates = (
+        Job.objects.filter(state__in=(Job.QUEUED, Job.RUNNING), available_at__lte=now)
+        .order_by('-priority', 'available_at', 'id')
+        .values_list('id', 'state', 'available_at', 'attempts', 'max_attempts', 'timeout')[:limit * 2]
+    )
+    claimed = []
+    for pk, state, available_at, attempts, max_attempts, timeout in candidates:
+        current = Job.objects.filter(pk=pk, state=state, available_at=available_at, attempts=attempts)
+        if attempts >= max_attempts:
+            # Its last attempt outlived the lease.
+            current.update(state=Job.FAILED, last_error='Timed out after %d seconds' % timeout)
+            continue
+        token = uuid.uuid4().hex
+        if current.update(
+            state=Job.RUNNING, locked_by=token, attempts=F('attempts') + 1,
+            available_at=now + datetime.timedelta(seconds=timeout),
+        ):
+            claimed.append((pk, token))
+            if len(claimed) == limit:
+                break
+    return claimed
+
+
+def run_job(pk, token):
+    """Run a claimed job. Success deletes the row; a failure is retried
+    with backoff until max_attempts, then kept as FAILED with the
+    traceback. Jobs run at least once: one that outlives its lease can run
+    again elsewhere, so tasks should be safe to repeat."""
+    job = Job.objects.filter(pk=pk, state=Job.RUNNING, locked_by=token).first()
+    if job is None:
+        return False
+    try:
+        resolve(job.task)(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %d', job.pk, job.task, job.attempts, exc_info=True)
+        mine = Job.objects.filter(pk=pk, state=Job.RUNNING, locked_by=token)
+        if job.attempts >= job.max_attempts:
+            mine.update(state=Job.FAILED, last_error=error)
+        else:
+            mine.update(state=Job.QUEUED, last_error=error, available_at=timezone.now() + retry_delay(job.attempts))
+        return False
+    Job.objects.filter(pk=pk, locked_by=token).delete()
+    return True
+
+
+def setup_worker_process():
+    # Initializer of run_worker's process pool. A forked child starts with
+    # copies of the parent's connection objects, which CONN_MAX_AGE keeps
+    # open; an SQLite handle must never be used by two processes, so they
+    # are dropped before the child's first query.
+    connections.close_all()
+    django.setup()
+
+
+def run_in_worker(pk, token):
+    # Entry point on pool threads and processes, which each hold their own
+    # database connection.
+    close_old_connections()
+    try:
+        return run_job(pk, token)
+    finally:
+        close_old_connections()
@@ -0,0 +1,126 @@
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.db import sqlite_pragmas
+
+SCHEMA = [
+    'CREATE TABLE product (id INTEGER PRIMARY KEY, name TEXT, price_paise INTEGER, digital INTEGER)',
+    'CREATE TABLE orders (id INTEGER PRIMARY KEY, customer_id INTEGER, complete INTEGER)',
+    'CREATE TABLE orderitem (id INTEGER PRIMARY KEY, order_id INTEGER, product_id INTEGER, quantity INTEGER, '
+    'UNIQUE (order_id, product_id))',
+]
+
+READ_SQL = (
+    'SELECT SUM(i.quantity), SUM(i.quantity * p.price_paise) FROM orderitem i '
+    'JOIN product p ON p.id = i.product_id WHERE i.order_id = ?'
+)
+CATALOG_SQL = 'SELECT id, name, price_paise FROM product ORDER BY id LIMIT 24 OFFSET ?'
+
+
+def seed(path, pragmas, products, orders):
+    db = sqlite3.connect(path)
+    # journal_mode is stored in the database file, so set it once up front.
+    db.execute('PRAGMA journal_mode = %s' % pragmas.get('journal_mode', 'DELETE'))
+    for statement in SCHEMA:
+        db.execute(statement)
+    db.executemany('INSERT INTO product VALUES (?, ?, ?, 0)',
+                   ((i, 'Product %d' % i, random.randint(1, 5000) * 100) for i in range(1, products + 1)))
+    db.executemany('INSERT INTO orders VALUES (?, ?, 0)', ((i, i) for i in range(1, orders + 1)))
+    db.commit()
+    db.close()
+
+
+def worker(args):
+    path, pragmas, duration, read_ratio, products, orders = args
+    random.seed()  # forked workers would otherwise replay the same sequence
+    db = sqlite3.connect(path, timeout=pragmas.get('busy_timeout', 0) / 1000, isolation_level=None)
+    for name, value in pragmas.items():
+        if name != 'journal_mode':
+            db.execute('PRAGMA %s = %s' % (name, value))
+
+    reads = writes = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        order_id = random.randint(1, orders)
+        try:
+            if random.random() < read_ratio:
+                db.execute(CATALOG_SQL, (random.randint(0, products // 24) * 24,)).fetchall()
+                db.execute(READ_SQL, (order_id,)).fetchall()
+                reads += 1
+            else:
+                db.execute('BEGIN')
+                product_id = random.randint(1, products)
+                cursor = db.execute('UPDATE orderitem SET quantity = quantity + 1 WHERE order_id = ? AND product_id = ?',
+                                    (order_id, product_id))
+                if not cursor.rowcount:
+                    db.execute('INSERT INTO orderitem (order_id, product_id, quantity) VALUES (?, ?, 1)',
+                               (order_id, product_id))
+                db.execute('COMMIT')
+                writes += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+    db.close()
+    return reads, writes, errors
+
+
+class Command(BaseCommand):
+    help = ('Compare SQLite throughput with default settings and with SQLITE_PRAGMAS '
+            'using N concurrent worker processes on a scratch database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per run.')
+        parser.add_argument('--read-ratio', type=float, default=0.8)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def handle(self, *args, **options):
+        # busy_timeout is part of both runs so "default" is not just failing
+        # fast; the difference measured is journaling and caching.
+        busy = {'busy_timeout': sqlite_pragmas().get('busy_timeout', 5000)}
+        configurations = [
+            ('default', dict(busy, journal_mode='DELETE', synchronous='FULL')),
+            ('tuned', sqlite_pragmas()),
+        ]
+
+        results = []
+        for label, pragmas in configurations:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                seed(path, pragmas, options['products'], options['orders'])
+                jobs = [(path, pragmas, options['duration'], options['read_ratio'],
+                         options['products'], options['orders'])] * options['workers']
+                started = time.monotonic()
+                with multiprocessing.Pool(options['workers']) as pool:
+                    counts = pool.map(worker, jobs)
+                elapsed = time.monotonic() - started
+
+            reads, writes, errors = (sum(column) for column in zip(*counts))
+            results.append({
+                'config': label,
+                'workers': options['workers'],
+                'seconds': round(elapsed, 2),
+                'reads_per_sec': round(reads / elapsed, 1),
+                'writes_per_sec': round(writes / elapsed, 1),
+                'requests_per_sec': round((reads + writes) / elapsed, 1),
+                'lock_errors': errors,
+            })
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for row in results:
+            self.stdout.write(
+                '%(config)-8s workers=%(workers)d  %(requests_per_sec)10.1f req/s  '
+                '(%(reads_per_sec).1f reads/s, %(writes_per_sec).1f writes/s, %(lock_errors)d lock errors)' % row
+            )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.assets import brotli, build_assets
+
+
+class Command(BaseCommand):
+    help = 'Bundle, minify, hash and precompress the CSS/JS bundles in settings.ASSET_BUNDLES.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clean', action='store_true',
+                            help='Delete previously built files that are no longer referenced.')
+
+    def handle(self, *args, **options):
+        manifest, sizes = build_assets(clean=options['clean'])
+        for name, path in sorted(manifest.items()):
+            self.stdout.write('%-14s -> %s (%d bytes)' % (name, path, sizes[name]))
+        if brotli is None:
+            self.stdout.write(self.style.WARNING('brotli is not installed; only .gz files were written.'))
+        self.stdout.write(self.style.SUCCESS('Built %d bundle(s).' % len(manifest)))
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, ExportError, export_lines, export_queryset, parse_export_date
+
+
+class Command(BaseCommand):
+    help = 'Stream orders with their line items and totals as CSV or JSONL.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--since', help='First order date to include (YYYY-MM-DD).')
+        parser.add_argument('--until', help='Last order date to include (YYYY-MM-DD).')
+        parser.add_argument('--complete', choices=('yes', 'no'), help='Only completed or only open orders.')
+        parser.add_argument('--output', help='File to write; default stdout.')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_export_date(options['since'], 'since')
+            until = parse_export_date(options['until'], 'until')
+        except ExportError as e:
+            raise CommandError(e)
+        complete = {'yes': True, 'no': False}.get(options['complete'])
+
+        lines = export_lines(options['format'], export_queryset(since, until, complete), options['chunk_size'])
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+
+from store.catalog import bump_catalog_version
+from store.images import needs_variants, render_variants
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail, card and detail derivatives for product images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes (default: one per CPU).')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate derivatives that are already up to date.')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Products written back per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image=None).only('id', 'image', 'image_variants')
+        todo = {
+            product.id: product for product in products.iterator(chunk_size=2000)
+            if options['force'] or needs_variants(product)
+        }
+        if not todo:
+            self.stdout.write('All product images are up to date.')
+            return
+
+        started = time.monotonic()
+        done, failed, pending = 0, 0, []
+        # Workers only touch file storage; all database writes happen here.
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as pool:
+            futures = {pool.submit(render_variants, product.image.name): product for product in todo.values()}
+            for future in as_completed(futures):
+                product = futures[future]
+                try:
+                    product.image_variants = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write('Product %s (%s): %s' % (product.id, product.image.name, e))
+                    continue
+
+                pending.append(product)
+                if len(pending) >= options['batch_size']:
+                    done += self.save(pending)
+                    pending = []
+        done += self.save(pending)
+
+        if done:
+            bump_catalog_version()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            'Generated derivatives for %d product(s) in %.1fs (%d failed).' % (done, elapsed, failed)
+        ))
+
+    def save(self, products):
+        Product.objects.bulk_update(products, ['image_variants'])
+        return len(products)
@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog import bump_catalog_version
+from store.images import render_variants
+from store.importer import RowError, chunks, clean_row, open_catalog, read_rows, upsert_products
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = ('Create or update products from a CSV or JSONL catalog (columns: sku, name, price, '
+            'digital, image), matched on sku, in bounded-memory chunks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Default: guessed from the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows per transaction.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes generating image derivatives; 0 skips images.')
+        parser.add_argument('--max-errors', type=int, default=100,
+                            help='Abort after this many invalid rows.')
+
+    def handle(self, *args, **options):
+        try:
+            stream, fmt = open_catalog(options['path'], options['format'])
+        except OSError as e:
+            raise CommandError(e)
+
+        started = time.monotonic()
+        self.rows = self.created = self.updated = self.errors = self.images = 0
+        self.in_flight, self.pending = {}, []
+        pool = None
+        if options['workers']:
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup)
+
+        try:
+            with stream:
+                for chunk in chunks(read_rows(stream, fmt), options['chunk_size']):
+                    created, updated, images = upsert_products(self.clean(chunk, options['max_errors']))
+                    self.created += created
+                    self.updated += updated
+                    if pool is not None:
+                        self.render(pool, images, options['workers'] * 4)
+
+                    elapsed = time.monotonic() - started
+                    self.stdout.write('%d rows, %.0f rows/s' % (self.rows, self.rows / elapsed))
+
+            if pool is not None:
+                self.render(pool, [], 0)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            bump_catalog_version()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d rows in %.1fs (%.0f rows/s): %d created, %d updated, %d invalid, %d images.' % (
+                self.rows, elapsed, self.rows / elapsed if elapsed else 0,
+                self.created, self.updated, self.errors, self.images,
+            )
+        ))
+
+    def clean(self, chunk, max_errors):
+        cleaned = []
+        for line_num, row in chunk:
+            self.rows += 1
+            try:
+                cleaned.append(clean_row(row))
+            except RowError as e:
+                self.errors += 1
+                self.stderr.write('Line %d: %s' % (line_num, e))
+                if self.errors >= max_errors:
+                    raise CommandError('Too many invalid rows (%d); aborting.' % self.errors)
+        return cleaned
+
+    def render(self, pool, products, limit):
+        # Keep at most `limit` images queued so memory stays bounded however
+        # large the feed; limit 0 drains everything.
+        for product in products:
+            self.in_flight[pool.submit(render_variants, product.image.name)] = product
+            if len(self.in_flight) > limit:
+                self.collect(wait(self.in_flight, return_when=FIRST_COMPLETED).done)
+        if not limit:
+            self.collect(wait(self.in_flight).done)
+        self.save(force=not limit)
+
+    def collect(self, futures):
+        for future in futures:
+            product = self.in_flight.pop(future)
+            try:
+                product.image_variants = future.result()
+            except Exception as e:
+                self.stderr.write('Product %s (%s): %s' % (product.sku, product.image.name, e))
+                continue
+            self.pending.append(product)
+
+    def save(self, force=False):
+        if self.pending and (force or len(self.pending) >= 200):
+            Product.objects.bulk_update(self.pending, ['image_variants'])
+            self.images += len(self.pending)
+            self.pending = []
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from store.assets import brotli
+from store.prerender import PRERENDERED_PAGES, NotPrerenderable, build_page, prerender_dir
+
+
+class Command(BaseCommand):
+    help = 'Render the static content pages to HTML, gzip and brotli files for the prerendered views.'
+
+    def handle(self, *args, **options):
+        built = 0
+        for name in PRERENDERED_PAGES:
+            try:
+                size = build_page(name)
+            except NotPrerenderable as e:
+                self.stdout.write('%-12s skipped: %s' % (name, e))
+                continue
+            built += 1
+            self.stdout.write('%-12s %d bytes' % (name, size))
+        if brotli is None:
+            self.stdout.write(self.style.WARNING('brotli is not installed; only .gz files were written.'))
+        self.stdout.write(self.style.SUCCESS('Prerendered %d page(s) into %s.' % (built, prerender_dir())))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Order, OrderItem, cart_summary_expressions
+
+
+class Command(BaseCommand):
+    help = ("Compare every order's stored item_count and total with its lines and "
+            "repair the ones that have drifted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without repairing it.')
+
+    def handle(self, *args, **options):
+        summary = cart_summary_expressions()
+        checked = drifted = 0
+        last_id = 0
+        while True:
+            # Keyset batches: each one is an index range scan however far in.
+            batch = list(
+                Order.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', 'item_count', 'total')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            actual = {
+                row['order']: (row['items'], row['total'])
+                for row in OrderItem.objects.filter(order__in=[pk for pk, _, _ in batch])
+                .order_by().values('order')
+                .annotate(items=summary['cart_items'], total=summary['cart_total'])
+            }
+            wrong = [
+                pk for pk, item_count, total in batch
+                if actual.get(pk, (0, 0)) != (item_count, total or 0)
+            ]
+            checked += len(batch)
+            drifted += len(wrong)
+            if wrong and options['verbosity'] > 1:
+                self.stdout.write('Drifted: %s' % ', '.join(map(str, wrong)))
+            if wrong and not options['dry_run']:
+                Order.objects.filter(pk__in=wrong).recompute_totals()
+
+        self.stdout.write('Checked %d orders, %d %s.' % (
+            checked, drifted, 'drifted' if options['dry_run'] else 'repaired',
+        ))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.reports import rebuild_sales_rollups, refresh_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold orders completed since the last run into the daily sales rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Discard the rollups and rebuild them from every completed order.')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep refreshing every N seconds instead of exiting.')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            folded = rebuild_sales_rollups(batch_size=options['batch_size'])
+            self.stdout.write('Rebuilt the rollups from %d order(s).' % folded)
+        while True:
+            folded = refresh_sales_rollups(batch_size=options['batch_size'])
+            if folded or options['verbosity'] > 1:
+                self.stdout.write('Rolled up %d order(s).' % folded)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
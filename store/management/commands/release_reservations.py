@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.inventory import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Return the stock held by expired reservations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep sweeping every N seconds instead of exiting.')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired(batch_size=options['batch_size'])
+            if released or options['verbosity'] > 1:
+                self.stdout.write('Released %d expired reservation(s).' % released)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
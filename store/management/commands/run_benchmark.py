@@ -0,0 +1,51 @@
+import contextlib
+import datetime
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from store.benchmark import SCENARIOS, environment, run_scenario
+
+
+class Command(BaseCommand):
+    help = ('Drive the storefront views through the test client at a given concurrency '
+            'and print latency percentiles, throughput and queries per request as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Any of %s. Default: all.' % ', '.join(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=200, help='Requests per scenario.')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per thread.')
+        parser.add_argument('--output', help='Write the JSON report to this file as well.')
+        parser.add_argument('--throttle', action='store_true',
+                            help='Keep THROTTLE_RATES in force; by default every request reaches the view.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(SCENARIOS)
+        if unknown:
+            raise CommandError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+        report = {
+            'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'environment': environment(),
+            'scenarios': {},
+        }
+        for scenario in options['scenarios'] or SCENARIOS:
+            throttle = contextlib.nullcontext() if options['throttle'] else override_settings(THROTTLE_RATES={})
+            with throttle:
+                try:
+                    result = run_scenario(scenario, options['requests'], options['concurrency'], options['warmup'])
+                except ValueError as exc:
+                    raise CommandError(exc)
+            report['scenarios'][scenario] = result
+            self.stderr.write('%-14s %8.1f req/s  p50 %7.2fms  p99 %7.2fms  %5.1f queries' % (
+                scenario, result['throughput'] or 0, result['p50_ms'] or 0, result['p99_ms'] or 0,
+                result['queries_per_request'] or 0,
+            ))
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,63 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from store.jobs import claim, run_in_worker, setup_worker_process
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (see store.jobs) until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=os.cpu_count() or 1,
+                            help='Jobs run at once (default: one per CPU).')
+        parser.add_argument('--pool', choices=('thread', 'process'), default='thread',
+                            help='Run jobs on threads (I/O-bound work) or processes (CPU-bound work).')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between checks of an empty queue.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        if options['pool'] == 'process':
+            # Children must not inherit this process's database connections.
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=concurrency, initializer=setup_worker_process)
+        else:
+            pool = ThreadPoolExecutor(max_workers=concurrency)
+
+        # Only as many jobs are claimed as there are free slots, so no job
+        # sits leased in a local queue while its lease runs down.
+        in_flight = {}
+        done = failed = 0
+        try:
+            while True:
+                free = concurrency - len(in_flight)
+                for pk, token in claim(free) if free else []:
+                    in_flight[pool.submit(run_in_worker, pk, token)] = pk
+
+                if not in_flight:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                finished, _ = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pk = in_flight.pop(future)
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        ok = False
+                        self.stderr.write('Job %s: %s' % (pk, e))
+                    done += ok
+                    failed += not ok
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping; waiting for %d running job(s).' % len(in_flight))
+        finally:
+            pool.shutdown(wait=True)
+
+        self.stdout.write('Ran %d job(s), %d failed.' % (done, failed))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.benchmark import seed
+
+
+class Command(BaseCommand):
+    help = 'Bulk-load synthetic products, customers and orders for run_benchmark.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--customers', type=int, default=50000)
+        parser.add_argument('--orders', type=int, default=1000000, help='Completed orders.')
+        parser.add_argument('--items-per-order', type=int, default=1)
+        parser.add_argument('--cart-lines', type=int, default=5, help='Lines in each customer\'s open cart.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        seed(
+            products=options['products'], customers=options['customers'], orders=options['orders'],
+            items_per_order=options['items_per_order'], cart_lines=options['cart_lines'],
+            batch_size=options['batch_size'], seed=options['seed'], log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS('Seeded in %.1fs' % (time.monotonic() - started)))
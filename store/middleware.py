@@ -0,0 +1,85 @@
+import logging
+import math
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+from .cart import Cart
+from .querycount import QueryRecorder
+from .throttle import get_backend, throttle_rates
+
+logger = logging.getLogger(__name__)
+
+
+class CartMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.cart = Cart(request)
+        return self.get_response(request)
+
+
+class QueryBudgetMiddleware:
+    # Logs a warning when a view runs more queries than its entry in
+    # settings.QUERY_BUDGETS (keyed by URL name) or QUERY_BUDGET_DEFAULT.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        name = match.url_name if match else None
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(name, getattr(settings, 'QUERY_BUDGET_DEFAULT', None))
+        if budget is not None and recorder.count > budget:
+            logger.warning(
+                'Query budget exceeded for %s (%s): %d > %d\n%s',
+                request.path, name, recorder.count, budget, recorder.summary(),
+            )
+        return response
+
+
+class ThrottleMiddleware:
+    # Token-bucket limits from settings.THROTTLE_RATES, keyed by URL name,
+    # on requests that change something. The client's IP is checked first,
+    # from the socket alone, so a flood is turned away before the session or
+    # any other database work. Logged-in users then have a bucket of their
+    # own, shared by all their addresses.
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in self.SAFE_METHODS:
+            return None
+        name = request.resolver_match.url_name
+        rates = throttle_rates(name)
+        if not rates:
+            return None
+
+        backend = get_backend()
+        wait = 0
+        if 'ip' in rates:
+            wait = backend.take('ip:%s:%s' % (name, request.META.get('REMOTE_ADDR', '')), *rates['ip'])
+        if not wait and 'user' in rates:
+            user_id = request.session.get('_auth_user_id')
+            if user_id is not None:
+                wait = backend.take('user:%s:%s' % (name, user_id), *rates['user'])
+        if wait:
+            return self.too_many_requests(request, wait)
+        return None
+
+    def too_many_requests(self, request, wait):
+        message = 'Too many requests, please try again shortly.'
+        if request.content_type == 'application/json':
+            response = JsonResponse({'error': message}, status=429)
+        else:
+            response = HttpResponse(message, status=429, content_type='text/plain')
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.14 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_useraddress'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'date_order', 'id'], name='store_order_history_idx'),
+        ),
+    ]
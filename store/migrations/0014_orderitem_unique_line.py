@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    OrderItem = apps.get_model('store', 'OrderItem')
+    duplicates = (
+        OrderItem.objects.exclude(order=None).exclude(product=None)
+        .values('order', 'product')
+        .annotate(lines=Count('id'), keep=Min('id'), quantity=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for row in duplicates:
+        lines = OrderItem.objects.filter(order=row['order'], product=row['product'])
+        lines.filter(id=row['keep']).update(quantity=row['quantity'])
+        lines.exclude(id=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_order_history_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='store_orderitem_unique_line'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.db.models import F, IntegerField
+from django.db.models.functions import Cast
+
+
+def backfill_price_paise(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    # Same rule as Product.to_paise(): whole rupees at a conversion rate of 10.
+    Product.objects.exclude(price=None).update(
+        price_paise=Cast(F('price') * 10, IntegerField()) * 100,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_orderitem_unique_line'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='price_paise',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_price_paise, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price_paise', 'id'], name='store_product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name', 'id'], name='store_product_name_idx'),
+        ),
+    ]
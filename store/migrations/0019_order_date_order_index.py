@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_product_sku'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='date_order',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
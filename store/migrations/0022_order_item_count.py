@@ -0,0 +1,31 @@
+from django.db import migrations, models
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+
+    lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    paise = Sum(F('quantity') * Coalesce(F('price_paise'), F('product__price_paise')), output_field=IntegerField())
+    Order.objects.update(
+        item_count=Coalesce(Subquery(lines.annotate(n=Sum('quantity')).values('n')), Value(0)),
+        total=Coalesce(Subquery(lines.annotate(t=paise / Value(100)).values('t')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_inventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,11 @@
 from django.db import models
+from django.db.models import Case, F, IntegerField, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.utils.functional import cached_property
+
+_UNKNOWN = object()
 
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -11,14 +17,49 @@ class Customer(models.Model):
 
 class Product(models.Model):
     name = models.CharField(max_length=200, null=True)
+    # Supplier stock keeping unit; import_catalog matches rows on it.
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     price = models.FloatField(null=True) 
+    # The rupee price charged, in paise; derived from `price` on save.
+    price_paise = models.IntegerField(null=True, blank=True, editable=False)
     digital = models.BooleanField(default=False, null=True, blank=True)
     image = models.ImageField(null=True, blank=True)
+    # Paths of the resized copies of `image`, see store.images.
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     conversion_rate = 10 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['price_paise', 'id'], name='store_product_price_idx'),
+            models.Index(fields=['name', 'id'], name='store_product_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # What the row holds, so save() can tell whether the price moved;
+        # unknown when the field was deferred.
+        product._saved_price_paise = product.__dict__.get('price_paise', _UNKNOWN)
+        return product
+
+    def save(self, *args, **kwargs):
+        self.price_paise = self.to_paise(self.price)
+        self._price_changed = self.price_paise != getattr(self, '_saved_price_paise', _UNKNOWN)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'price' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'price_paise'}
+        super().save(*args, **kwargs)
+        self._saved_price_paise = self.price_paise
+
+    @classmethod
+    def to_paise(cls, price):
+        if price is None:
+            return None
+        return int(price * cls.conversion_rate) * 100
+
     @property
     def imageURL(self):
         try:
@@ -27,59 +68,151 @@ class Product(models.Model):
             url = ''
         return url
 
+    def variantURL(self, variant, fmt='jpeg'):
+        path = (self.image_variants or {}).get(variant, {}).get(fmt)
+        if path:
+            return default_storage.url(path)
+        return self.imageURL
+
+    def variantSrcset(self, fmt):
+        variants = self.image_variants or {}
+        return ', '.join(
+            '%s %dw' % (default_storage.url(variants[name][fmt]), variants[name]['width'])
+            for name in ('thumb', 'card', 'detail') if name in variants
+        )
+
+    @property
+    def thumbnailURL(self):
+        return self.variantURL('thumb')
+
+    @property
+    def cardURL(self):
+        return self.variantURL('card')
+
+    @property
+    def detailURL(self):
+        return self.variantURL('detail')
+
+    @property
+    def jpegSrcset(self):
+        return self.variantSrcset('jpeg')
+
+    @property
+    def webpSrcset(self):
+        return self.variantSrcset('webp')
+
     @property
     def price_in_rupees(self):
-        return int(self.price * self.conversion_rate)
+        if self.price_paise is None:
+            return int(self.price * self.conversion_rate)
+        return self.price_paise // 100
+
+def cart_summary_expressions(prefix=''):
+    # Item count, rupee total and shipping flag for a cart as SQL aggregates.
+    # `prefix` is the lookup path from the queried model to OrderItem.
+    quantity = F(prefix + 'quantity')
+    # Placed orders are priced at the snapshot taken at checkout.
+    unit_paise = Coalesce(F(prefix + 'price_paise'), F(prefix + 'product__price_paise'))
+    line_paise = Sum(quantity * unit_paise, output_field=IntegerField())
+    return {
+        'cart_items': Coalesce(Sum(quantity), Value(0)),
+        'cart_total': Coalesce(line_paise / Value(100), Value(0)),
+        'cart_shipping': Coalesce(Max(Case(
+            When(**{prefix + 'product__digital': False, 'then': Value(1)}),
+            default=Value(0),
+            output_field=IntegerField(),
+        )), Value(0)),
+    }
+
+def order_totals_expressions():
+    # Order.item_count and Order.total recomputed from the order's lines, as
+    # correlated subqueries usable in UPDATE.
+    lines = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    summary = cart_summary_expressions()
+    return {
+        'item_count': Coalesce(Subquery(lines.annotate(n=summary['cart_items']).values('n')), Value(0)),
+        'total': Coalesce(Subquery(lines.annotate(t=summary['cart_total']).values('t')), Value(0)),
+    }
+
+class OrderQuerySet(models.QuerySet):
+    def recompute_totals(self):
+        return self.update(**order_totals_expressions())
 
 class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
-    date_order = models.DateTimeField(auto_now_add=True)
+    date_order = models.DateTimeField(auto_now_add=True, db_index=True)
     complete = models.BooleanField(default=False, null=True, blank=True)
     transaction_id = models.CharField(max_length=200, null=True)
     payment_method = models.CharField(max_length=50, null=True, blank=True)  # New field
     name = models.CharField(max_length=255, null=True, blank=True)
     email = models.EmailField(max_length=255, null=True, blank=True)
+    # Kept current by the cart service and checkout with F() updates, so
+    # reading a cart's size or total never touches its lines;
+    # reconcile_order_totals repairs any drift.
     total = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    item_count = models.IntegerField(default=0)
     address = models.CharField(max_length=255, null=True, blank=True)
     city = models.CharField(max_length=255, null=True, blank=True)
     state = models.CharField(max_length=255, null=True, blank=True)
     zipcode = models.CharField(max_length=10, null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    # Sent with the checkout form; a resubmitted form finds the order it
+    # already placed instead of placing another.
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a customer's order history.
+            models.Index(fields=['customer', 'date_order', 'id'], name='store_order_history_idx'),
+            # The sales rollup's watermark scan.
+            models.Index(fields=['completed_at', 'id'], name='store_order_completed_idx'),
+        ]
 
     def __str__(self):
         return str(self.id)
 
-    @property
+    @cached_property
     def shipping(self):
-        shipping = False
-        orderitems = self.orderitem_set.all()
-        for i in orderitems:
-            if i.product.digital == False:
-                shipping = True
-        return shipping
+        return self.orderitem_set.filter(product__digital=False).exists()
 
     @property
     def get_cart_total(self):
-        orderitems = self.orderitem_set.all()
-        total = sum([item.get_total for item in orderitems])
-        return total
+        # Whole amounts read as ints, like the guest cart's totals.
+        total = self.total or 0
+        return int(total) if total == int(total) else total
 
     @property
     def get_cart_items(self):
-        orderitems = self.orderitem_set.all()
-        total = sum([item.quantity for item in orderitems])
-        return total
+        return self.item_count
 
 class OrderItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True)
     quantity = models.IntegerField(default=0, null=True, blank=True)
+    # Unit price in paise when the order was placed; empty while in a cart.
+    price_paise = models.IntegerField(null=True, blank=True, editable=False)
     date_added = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One line per product in an order; cart updates upsert into it.
+            models.UniqueConstraint(fields=['order', 'product'], name='store_orderitem_unique_line'),
+        ]
+
+    @property
+    def unit_price(self):
+        if self.price_paise is not None:
+            return self.price_paise // 100
+        return self.product.price_in_rupees
+
     @property
     def get_total(self):
-        total = self.product.price_in_rupees * self.quantity
+        total = self.unit_price * self.quantity
         return total
 
+
 # class ShippingAddress(models.Model):
 #     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
 #     order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True)
@@ -115,3 +248,101 @@ class UserAddress(models.Model):
 
 
 
+
+
+class StockBucket(models.Model):
+    # A product's stock is split across several rows so that concurrent
+    # buyers of one hot product decrement different rows; see store.inventory.
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_buckets')
+    bucket = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'bucket'], name='store_stockbucket_unique'),
+            models.CheckConstraint(check=models.Q(quantity__gte=0), name='store_stockbucket_quantity_gte_0'),
+        ]
+
+
+class Reservation(models.Model):
+    HELD = 'held'
+    COMMITTED = 'committed'
+    RELEASED = 'released'
+    STATES = [(HELD, 'Held'), (COMMITTED, 'Committed'), (RELEASED, 'Released')]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True)
+    # The StockBucket the quantity was taken from and is returned to.
+    bucket = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField()
+    state = models.CharField(max_length=10, choices=STATES, default=HELD)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'expires_at'], name='store_reservation_expiry_idx'),
+            models.Index(fields=['order', 'state'], name='store_reservation_order_idx'),
+        ]
+
+
+class DailySales(models.Model):
+    # Rollups of completed orders by the local date of completed_at,
+    # maintained by refresh_sales_rollups; see store.reports.
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+
+class DailyProductSales(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='store_dailyproductsales_unique'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    # The last order (by completed_at, id) folded into a rollup.
+    name = models.CharField(max_length=50, unique=True)
+    completed_at = models.DateTimeField(null=True)
+    order_id = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class Job(models.Model):
+    # A call of a store.jobs task, run by the run_worker command.
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (FAILED, 'Failed')]
+
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    state = models.CharField(max_length=10, choices=STATES, default=QUEUED)
+    # When the job may next be claimed: its scheduled time while queued, the
+    # end of its lease while running. A worker that dies mid-job leaves it
+    # to be claimed again once the lease runs out.
+    available_at = models.DateTimeField()
+    timeout = models.PositiveIntegerField(default=300)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    locked_by = models.CharField(max_length=64, blank=True, default='')
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'available_at'], name='store_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%s' % (self.task, self.id)
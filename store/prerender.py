@@ -0,0 +1,240 @@
+import functools
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.template.loader import get_template, render_to_string
+from django.template.loader_tags import ExtendsNode, IncludeNode
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from .assets import _manifest_path, brotli
+from .cart import Cart
+from .utils import CART_COOKIE
+
+# Content pages that look the same for every anonymous visitor with an empty
+# cart. `prerender_pages` renders them to PRERENDER_DIR at deploy time as
+# <name>.html plus <name>.<md5 of the html>.html.gz and .html.br, so a
+# compressed copy can only ever be served with the page it was made from. The
+# @prerendered views serve those bytes from memory and re-render a page once
+# any template it is built from, or the asset manifest, is newer than the
+# file.
+PRERENDERED_PAGES = {
+    'about_us': 'store/about_us.html',
+    'contact_us': 'store/contact_us.html',
+    'faq': 'store/faq.html',
+    'track': 'store/track.html',
+    'returns': 'store/return.html',
+    'offer': 'store/offer.html',
+    'gift': 'store/gift.html',
+    'career': 'store/career.html',
+    'press': 'store/press.html',
+    'blog': 'store/blog.html',
+}
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class NotPrerenderable(Exception):
+    pass
+
+
+def prerender_dir():
+    return getattr(settings, 'PRERENDER_DIR', os.path.join(settings.BASE_DIR, 'prerendered'))
+
+
+def _constant_name(expression):
+    # The template name of an {% extends %} or {% include %} given as a
+    # string literal, else None.
+    name = getattr(expression, 'var', None)
+    return name if isinstance(name, str) else None
+
+
+def template_files(template_name, seen=None):
+    """Paths of a template and every template it extends or includes by a
+    literal name."""
+    seen = set() if seen is None else seen
+    template = get_template(template_name).template
+    if template.origin.name in seen:
+        return seen
+    seen.add(template.origin.name)
+    for node in template.nodelist.get_nodes_by_type(ExtendsNode):
+        parent = _constant_name(node.parent_name)
+        if parent:
+            template_files(parent, seen)
+    for node in template.nodelist.get_nodes_by_type(IncludeNode):
+        included = _constant_name(node.template)
+        if included:
+            template_files(included, seen)
+    return seen
+
+
+def _newest_source(template_name):
+    newest = 0
+    for path in template_files(template_name) | {_manifest_path()}:
+        try:
+            newest = max(newest, os.stat(path).st_mtime)
+        except OSError:
+            pass
+    return newest
+
+
+def render_page(name):
+    # As an anonymous visitor with no cookies would see it.
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = reverse(name)
+    request.user = AnonymousUser()
+    request.cart = Cart(request)
+    html = render_to_string(PRERENDERED_PAGES[name], request=request)
+    if 'CSRF_COOKIE' in request.META:
+        raise NotPrerenderable('%s contains a per-visitor CSRF token' % PRERENDERED_PAGES[name])
+    return html.encode('utf-8')
+
+
+def _variant_path(name, digest, suffix):
+    return os.path.join(prerender_dir(), '%s.%s.html%s' % (name, digest, suffix))
+
+
+def _write(path, content):
+    # Each writer fills a temporary file of its own and renames it into
+    # place, so a reader opens either a complete old file or a complete new
+    # one.
+    fd, tmp = tempfile.mkstemp(dir=prerender_dir())
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def build_page(name):
+    content = render_page(name)
+    digest = hashlib.md5(content).hexdigest()
+    os.makedirs(prerender_dir(), exist_ok=True)
+    # The compressed copies go first, so the page never names one that is
+    # not there yet.
+    _write(_variant_path(name, digest, '.gz'), gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write(_variant_path(name, digest, '.br'), brotli.compress(content))
+    _write(os.path.join(prerender_dir(), name + '.html'), content)
+
+    # Drop the compressed copies of earlier builds.
+    for filename in os.listdir(prerender_dir()):
+        page, _, rest = filename.partition('.')
+        if page == name and rest.count('.') == 2 and not rest.startswith(digest + '.'):
+            try:
+                os.remove(os.path.join(prerender_dir(), filename))
+            except FileNotFoundError:
+                pass
+    return len(content)
+
+
+class _Page:
+    def __init__(self, built=None, source=None, bodies=None, digest=None):
+        self.built = built
+        self.source = source
+        self.bodies = bodies or {}
+        self.etag = 'W/"%s"' % digest if bodies else None
+        self.checked = time.monotonic()
+
+
+_pages = {}
+# One lock per page: a rebuild holds up requests for that page only.
+_locks = {name: threading.Lock() for name in PRERENDERED_PAGES}
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def load_page(name):
+    """The prerendered page for a URL name, rebuilt first if its templates
+    changed, or None if it has to be rendered per request."""
+    page = _pages.get(name)
+    interval = getattr(settings, 'PRERENDER_CHECK_SECONDS', 2)
+    if page is not None and time.monotonic() - page.checked < interval:
+        return page if page.bodies else None
+
+    with _locks[name]:
+        source = _newest_source(PRERENDERED_PAGES[name])
+        path = os.path.join(prerender_dir(), name + '.html')
+        try:
+            built = os.stat(path).st_mtime
+        except OSError:
+            built = None
+
+        if page is not None and page.source == source and page.built == built:
+            page.checked = time.monotonic()
+            return page if page.bodies else None
+
+        if built is None or built < source:
+            try:
+                build_page(name)
+            except NotPrerenderable:
+                _pages[name] = _Page(source=source)
+                return None
+            built = os.stat(path).st_mtime
+
+        html = _read(path)
+        if html is None:
+            return None
+        digest = hashlib.md5(html).hexdigest()
+        bodies = {None: html}
+        for encoding, suffix in ENCODINGS:
+            body = _read(_variant_path(name, digest, suffix))
+            if body is not None:
+                bodies[encoding] = body
+        page = _pages[name] = _Page(built, source, bodies, digest)
+        return page
+
+
+def _accepts(request, encoding):
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    return any(part.split(';')[0].strip() == encoding for part in accepted.split(','))
+
+
+def serve_page(request, page):
+    if page.etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        encoding = next((encoding for encoding, _ in ENCODINGS
+                         if encoding in page.bodies and _accepts(request, encoding)), None)
+        response = HttpResponse(page.bodies[encoding], content_type='text/html; charset=utf-8')
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = page.etag
+    patch_vary_headers(response, ('Accept-Encoding', 'Cookie'))
+    return response
+
+
+def prerendered(name):
+    """Serve the view's page prerendered to visitors who would get the
+    same bytes: anonymous, with an empty cart, no queued messages and no
+    query string."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Messages queued for the visitor are theirs alone.
+            if (request.method in ('GET', 'HEAD') and not request.GET and CART_COOKIE not in request.COOKIES
+                    and not request.user.is_authenticated and not len(get_messages(request))):
+                page = load_page(name)
+                if page is not None:
+                    return serve_page(request, page)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,68 @@
+import re
+import time
+from collections import Counter
+
+from django.db import connections
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_SAVEPOINT = re.compile(r'"s\d+_x\d+"')
+
+
+def sql_shape(sql):
+    # Statements that differ only in the length of an IN list or in a
+    # savepoint name count as the same shape.
+    return _SAVEPOINT.sub('"sp"', _IN_LIST.sub('IN (...)', sql))
+
+
+class QueryRecorder:
+    """Record the SQL run on a connection, e.g. ``with QueryRecorder() as q:``."""
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    def __enter__(self):
+        self._wrapper = connections[self.using].execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for sql, duration in self.queries)
+
+    @property
+    def duplicates(self):
+        shapes = Counter(sql_shape(sql) for sql, duration in self.queries)
+        return {shape: n for shape, n in shapes.items() if n > 1}
+
+    def summary(self):
+        lines = ['%d queries in %.1fms' % (self.count, self.total_time * 1000)]
+        lines += ['  %dx %s' % (n, shape) for shape, n in sorted(self.duplicates.items(), key=lambda i: -i[1])]
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin asserting an exact query count with a readable failure."""
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        with QueryRecorder() as recorder:
+            result = func(*args, **kwargs)
+        if recorder.count != budget:
+            self.fail('Expected %d queries, got %s\n%s' % (
+                budget, recorder.summary(), '\n'.join('  ' + sql for sql, duration in recorder.queries),
+            ))
+        return result
@@ -0,0 +1,160 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import DailyProductSales, DailySales, Order, OrderItem, RollupWatermark
+
+# Sales reports read DailySales and DailyProductSales, which
+# refresh_sales_rollups folds completed orders into incrementally. Orders
+# are taken in (completed_at, id) order past a stored watermark, and the
+# rollup rows and the watermark move in one transaction, so each order is
+# counted exactly once however often the command runs.
+SALES_ROLLUP = 'sales'
+REPORT_MAX_DAYS = 366
+
+
+def rollup_lag():
+    # completed_at is stamped inside the checkout transaction, so an order
+    # that commits late can land just behind the watermark. Orders younger
+    # than the lag are left for the next run.
+    return datetime.timedelta(seconds=getattr(settings, 'SALES_ROLLUP_LAG_SECONDS', 60))
+
+
+def _pending(watermark, cutoff, batch_size):
+    orders = Order.objects.filter(complete=True, completed_at__lt=cutoff)
+    if watermark.completed_at is not None:
+        orders = orders.filter(
+            Q(completed_at__gt=watermark.completed_at) |
+            Q(completed_at=watermark.completed_at, id__gt=watermark.order_id)
+        )
+    return list(
+        orders.order_by('completed_at', 'id')
+        .values_list('id', 'completed_at', 'item_count', 'total')[:batch_size]
+    )
+
+
+def _summarize(batch):
+    days = defaultdict(lambda: [0, 0, Decimal(0)])
+    order_days = {}
+    for order_id, completed_at, item_count, total in batch:
+        day = timezone.localdate(completed_at)
+        order_days[order_id] = day
+        days[day][0] += 1
+        days[day][1] += item_count
+        days[day][2] += total or 0
+
+    # {(day, product_id): [order ids, units, paise]}
+    products = defaultdict(lambda: [set(), 0, 0])
+    lines = (
+        OrderItem.objects.filter(order__in=list(order_days), product__isnull=False)
+        .values_list('order_id', 'product_id', 'quantity')
+        .annotate(unit_paise=Coalesce('price_paise', 'product__price_paise'))
+    )
+    for order_id, product_id, quantity, unit_paise in lines:
+        row = products[order_days[order_id], product_id]
+        row[0].add(order_id)
+        row[1] += quantity or 0
+        row[2] += (quantity or 0) * (unit_paise or 0)
+    return days, products
+
+
+def _apply_days(days):
+    existing = {row.date: row for row in DailySales.objects.filter(date__in=list(days))}
+    new = []
+    for day, (orders, units, revenue) in days.items():
+        row = existing.get(day)
+        if row is None:
+            new.append(DailySales(date=day, orders=orders, units=units, revenue=revenue))
+            continue
+        row.orders += orders
+        row.units += units
+        row.revenue += revenue
+    DailySales.objects.bulk_update(existing.values(), ['orders', 'units', 'revenue'])
+    DailySales.objects.bulk_create(new)
+
+
+def _apply_products(products):
+    existing = {
+        (row.date, row.product_id): row for row in DailyProductSales.objects.filter(
+            date__in={day for day, _ in products}, product__in={product_id for _, product_id in products},
+        )
+    }
+    changed, new = [], []
+    for (day, product_id), (orders, units, paise) in products.items():
+        revenue = Decimal(paise) / 100
+        row = existing.get((day, product_id))
+        if row is None:
+            new.append(DailyProductSales(
+                date=day, product_id=product_id, orders=len(orders), units=units, revenue=revenue,
+            ))
+            continue
+        row.orders += len(orders)
+        row.units += units
+        row.revenue += revenue
+        changed.append(row)
+    DailyProductSales.objects.bulk_update(changed, ['orders', 'units', 'revenue'], batch_size=500)
+    DailyProductSales.objects.bulk_create(new, batch_size=500)
+
+
+def refresh_sales_rollups(batch_size=1000, now=None):
+    """Fold orders completed since the watermark (and before the lag) into
+    the rollups. Returns the number of orders folded."""
+    cutoff = (now or timezone.now()) - rollup_lag()
+    RollupWatermark.objects.get_or_create(name=SALES_ROLLUP)
+    folded = 0
+    while True:
+        watermark = RollupWatermark.objects.get(name=SALES_ROLLUP)
+        batch = _pending(watermark, cutoff, batch_size)
+        if not batch:
+            return folded
+        days, products = _summarize(batch)
+
+        last_id, last_completed_at = batch[-1][0], batch[-1][1]
+        with transaction.atomic():
+            # Claim the batch by moving the watermark from where it was read.
+            # A concurrent run that got there first leaves nothing to update
+            # and this batch is dropped rather than counted twice.
+            claimed = RollupWatermark.objects.filter(
+                pk=watermark.pk, completed_at=watermark.completed_at, order_id=watermark.order_id,
+            ).update(completed_at=last_completed_at, order_id=last_id, updated_at=timezone.now())
+            if not claimed:
+                continue
+            _apply_days(days)
+            _apply_products(products)
+        folded += len(batch)
+
+
+def rebuild_sales_rollups(batch_size=1000, now=None):
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailyProductSales.objects.all().delete()
+        RollupWatermark.objects.filter(name=SALES_ROLLUP).delete()
+    return refresh_sales_rollups(batch_size, now)
+
+
+def sales_report(start, end, top=20):
+    """Daily totals and best-selling products between two dates
+    (inclusive), read from the rollups alone."""
+    days = DailySales.objects.filter(date__range=(start, end))
+    return {
+        'start': start,
+        'end': end,
+        'days': list(days.order_by('-date')),
+        'totals': days.aggregate(
+            orders=Coalesce(Sum('orders'), 0), units=Coalesce(Sum('units'), 0),
+            revenue=Coalesce(Sum('revenue'), Decimal(0)),
+        ),
+        'products': list(
+            DailyProductSales.objects.filter(date__range=(start, end), product__isnull=False)
+            .values('product_id', 'product__name')
+            .annotate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+            .order_by('-revenue')[:top]
+        ),
+        'watermark': RollupWatermark.objects.filter(name=SALES_ROLLUP).first(),
+    }
@@ -0,0 +1,71 @@
+import re
+
+from django.db import connection
+
+from .models import Product
+
+# Full-text index over product names (the store_product_fts table created by
+# migration 0016), kept in sync by store.signals. Only SQLite has it; other
+# databases fall back to a name__icontains scan.
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def rebuild_index():
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM store_product_fts')
+        cursor.execute(
+            "INSERT INTO store_product_fts (rowid, name) SELECT id, COALESCE(name, '') FROM store_product"
+        )
+
+
+def index_products(products):
+    if not fts_enabled() or not products:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany('DELETE FROM store_product_fts WHERE rowid = %s', [(p.id,) for p in products])
+        cursor.executemany(
+            'INSERT INTO store_product_fts (rowid, name) VALUES (%s, %s)',
+            [(p.id, p.name or '') for p in products],
+        )
+
+
+def unindex_products(product_ids):
+    if not fts_enabled() or not product_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany('DELETE FROM store_product_fts WHERE rowid = %s', [(i,) for i in product_ids])
+
+
+def fts_query(text):
+    # Quote every word so user input can't inject FTS5 syntax, and prefix
+    # match the words so results show up while the user is still typing.
+    return ' '.join('"%s"*' % word for word in re.findall(r'\w+', text))
+
+
+def search_products(text, page=1, page_size=24):
+    query = fts_query(text)
+    if not query:
+        return [], False
+
+    offset = (page - 1) * page_size
+    if fts_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT rowid FROM store_product_fts WHERE store_product_fts MATCH %s '
+                'ORDER BY bm25(store_product_fts) LIMIT %s OFFSET %s',
+                [query, page_size + 1, offset],
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+    else:
+        ids = list(
+            Product.objects.filter(name__icontains=text.strip())
+            .order_by('name', 'id').values_list('id', flat=True)[offset:offset + page_size + 1]
+        )
+
+    products = Product.objects.in_bulk(ids[:page_size])
+    return [products[i] for i in ids[:page_size] if i in products], len(ids) > page_size
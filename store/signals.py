@@ -1,8 +1,18 @@
 
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from .models import Customer,Profile
+from .catalog import bump_catalog_version
+from .db import configure_sqlite
+from .images import generate_product_variants, needs_variants
+from .models import Customer,Order,Product,Profile
+from .search import index_products, unindex_products
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    configure_sqlite(connection)
 
 @receiver(post_save, sender=User)
 def create_customer(sender, instance, created, **kwargs):
@@ -12,3 +22,45 @@ def create_customer(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def save_customer(sender, instance, **kwargs):
     instance.customer.save()
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog(sender, instance, **kwargs):
+    # Bump again on commit: another request may have re-cached the old rows
+    # between the write and the end of the transaction.
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    index_products([instance])
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    unindex_products([instance.id])
+
+@receiver(post_save, sender=Product)
+def create_image_variants(sender, instance, **kwargs):
+    # Resizing takes seconds per image; run_worker does it off the request.
+    if needs_variants(instance):
+        generate_product_variants.enqueue(instance.pk)
+
+@receiver(post_save, sender=Product)
+def refresh_open_order_totals(sender, instance, created, **kwargs):
+    # Open carts are priced from the product, so a price change moves their
+    # stored totals. Placed orders keep their snapshot.
+    if not created and instance._price_changed:
+        Order.objects.filter(complete=False, orderitem__product=instance).recompute_totals()
+
+@receiver(pre_delete, sender=Product)
+def remember_open_orders(sender, instance, **kwargs):
+    # Deleting the product empties its lines' product, which drops them
+    # from the totals; note the carts now, while the lines still point here.
+    instance._open_order_ids = list(
+        Order.objects.filter(complete=False, orderitem__product=instance).values_list('id', flat=True).distinct()
+    )
+
+@receiver(post_delete, sender=Product)
+def refresh_totals_after_delete(sender, instance, **kwargs):
+    if getattr(instance, '_open_order_ids', None):
+        Order.objects.filter(pk__in=instance._open_order_ids).recompute_totals()
@@ -0,0 +1,10 @@
+from django import template
+
+from store.assets import bundle_tags
+
+register = template.Library()
+
+
+@register.simple_tag
+def bundle(name):
+    return bundle_tags(name)
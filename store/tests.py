@@ -1,3 +1,1110 @@
-from django.test import TestCase
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin, messages
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signing import get_cookie_signer
+from django.db import OperationalError, connection, transaction
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .assets import _manifest, build_assets, bundle_tags, bundle_urls, manifest_version, minify_css, minify_js
+from .cart import Cart
+from .catalog import _local, bump_catalog_version, catalog_version, get_catalog
+from .db import DEFAULT_SQLITE_PRAGMAS, configure_sqlite, is_locked_error, retry_on_locked, sqlite_pragmas
+from .jobs import claim, run_job, task
+from . import inventory, views
+from .images import IMAGE_FORMATS, IMAGE_VARIANTS, generate_product_variants, needs_variants
+from .inventory import OutOfStock, available, release, release_expired, reserve, set_stock
+from .models import (
+    Customer, DailyProductSales, DailySales, Job, Order, OrderItem, Product, Reservation, StockBucket, UserAddress,
+)
+from .querycount import QueryBudgetMixin, QueryRecorder, sql_shape
+from .prerender import _locks, _pages, load_page
+from .reports import refresh_sales_rollups
+from .search import fts_query, rebuild_index
+from .throttle import FileBuckets, LocalBuckets, _backend, parse_rate
+from .utils import (
+    CART_COOKIE, CART_COOKIE_MAX_BYTES, CART_COOKIE_SALT, decodeCart, encodeCart, orderCursor, parseOrderCursor,
+    readCartCookie,
+)
+from .views import ORDER_HISTORY_PAGE_SIZE
+
+CART_LINES = 40
+CALLS = []
+
+
+@task
+def record_call(value):
+    CALLS.append(value)
+
+
+@task(max_attempts=2, timeout=30)
+def always_fails():
+    raise RuntimeError('boom')
+
+
+@task
+def write_pid(path):
+    with open(path, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+class QueryRecorderTests(TestCase):
+    def test_records_count_and_duplicate_shapes(self):
+        with QueryRecorder() as recorder:
+            list(Product.objects.filter(id__in=[1, 2]))
+            list(Product.objects.filter(id__in=[1, 2, 3]))
+            Customer.objects.count()
+        self.assertEqual(recorder.count, 3)
+        self.assertEqual(list(recorder.duplicates.values()), [2])
+        self.assertGreaterEqual(recorder.total_time, 0)
+
+    def test_sql_shape_ignores_in_list_length(self):
+        self.assertEqual(
+            sql_shape('SELECT 1 WHERE id IN (%s, %s)'),
+            sql_shape('SELECT 1 WHERE id IN (%s, %s, %s, %s)'),
+        )
+
+    @override_settings(QUERY_BUDGETS={'store': 0})
+    def test_middleware_warns_over_budget(self):
+        self.client.force_login(User.objects.create_user('budget', password='secret-pass-123'))
+        with self.assertLogs('store.middleware', 'WARNING') as logs:
+            self.client.get(reverse('store'))
+        self.assertIn('Query budget exceeded', logs.output[0])
+
+
+class SqliteTuningTests(TransactionTestCase):
+    # Outside TestCase's wrapping transaction: pragmas such as synchronous
+    # cannot change inside one, and retry_on_locked never retries there.
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA %s' % name)
+            return cursor.fetchone()[0]
+
+    def test_pragmas_merge_settings_over_defaults(self):
+        self.addCleanup(configure_sqlite, connection)
+        with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234, 'mmap_size': None}):
+            pragmas = sqlite_pragmas()
+            configure_sqlite(connection)
+        self.assertEqual(pragmas['busy_timeout'], 1234)
+        self.assertNotIn('mmap_size', pragmas)
+        self.assertEqual(pragmas['synchronous'], DEFAULT_SQLITE_PRAGMAS['synchronous'])
+        self.assertEqual(self.pragma('busy_timeout'), 1234)
+        self.assertEqual(self.pragma('temp_store'), 2)
+
+    def flaky(self, failures, error='database is locked'):
+        calls = []
+
+        @retry_on_locked(attempts=3, delay=0)
+        def write(request):
+            calls.append(True)
+            if len(calls) <= failures:
+                raise OperationalError(error)
+            return 'done'
+        return write, calls
+
+    def test_retry_on_locked_retries_then_gives_up(self):
+        write, calls = self.flaky(2)
+        with self.assertLogs('store.db', 'WARNING') as logs:
+            self.assertEqual(write(None), 'done')
+        self.assertEqual((len(calls), len(logs.records)), (3, 2))
+
+        write, calls = self.flaky(3)
+        with self.assertLogs('store.db', 'WARNING'), self.assertRaises(OperationalError):
+            write(None)
+        self.assertEqual(len(calls), 3)
+
+    def test_retry_on_locked_reraises_other_errors_and_inside_atomic(self):
+        write, calls = self.flaky(1, error='no such table: store_thing')
+        with self.assertRaises(OperationalError):
+            write(None)
+        self.assertEqual(len(calls), 1)
+
+        # Retrying inside a transaction would repeat only part of it.
+        write, calls = self.flaky(1)
+        with transaction.atomic(), self.assertRaises(OperationalError):
+            write(None)
+        self.assertEqual(len(calls), 1)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    # Every page below runs a fixed number of queries, however many lines
+    # the cart has or orders the customer placed. A regression to per-line
+    # or per-order queries fails with the repeated SQL in the message.
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create([
+            Product(name='Product %d' % i, price=10 + i, price_paise=Product.to_paise(10 + i), digital=i % 2 == 0)
+            for i in range(CART_LINES + 5)
+        ])
+        cls.user = User.objects.create_user('shopper', 'shopper@example.com', 'secret-pass-123')
+        customer = Customer.objects.get(user=cls.user)
+
+        cls.open_order = Order.objects.create(customer=customer, complete=False)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=cls.open_order, product=product, quantity=2)
+            for product in cls.products[:CART_LINES]
+        ])
+
+        past_orders = Order.objects.bulk_create([Order(customer=customer, complete=True) for i in range(30)])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1)
+            for order in past_orders for product in cls.products[:5]
+        ])
+        Order.objects.recompute_totals()
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self):
+        self.client.force_login(self.user)
+
+    def set_guest_cart(self, lines):
+        cart = {product.id: 3 for product in self.products[:lines]}
+        signer = get_cookie_signer(salt=CART_COOKIE + CART_COOKIE_SALT)
+        self.client.cookies[CART_COOKIE] = signer.sign(encodeCart(cart))
+
+    def get(self, name, *args):
+        response = self.client.get(reverse(name, args=args))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def post_json(self, name, payload):
+        response = self.client.post(reverse(name), json.dumps(payload), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_store_anonymous(self):
+        # Once the catalog is cached the page needs no queries at all.
+        self.get('store')
+        self.assertQueryBudget(0, self.get, 'store')
+
+    def test_store_authenticated(self):
+        self.get('store')
+        self.login()
+        self.assertQueryBudget(3, self.get, 'store')
+
+    def test_store_revalidates_by_etag_only(self):
+        response = self.get('store')
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(reverse('store'), HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        # The page differs per visitor, so a date alone never validates it.
+        self.login()
+        response = self.client.get(reverse('store'), HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cart_guest(self):
+        self.set_guest_cart(CART_LINES)
+        response = self.assertQueryBudget(1, self.get, 'cart')
+        self.assertEqual(len(response.context['items']), CART_LINES)
+
+    def test_cart_authenticated(self):
+        self.login()
+        response = self.assertQueryBudget(4, self.get, 'cart')
+        self.assertEqual(len(response.context['items']), CART_LINES)
+
+    def test_checkout_guest(self):
+        self.set_guest_cart(CART_LINES)
+        self.assertQueryBudget(1, self.get, 'checkout')
+
+    def test_checkout_authenticated(self):
+        self.login()
+        response = self.assertQueryBudget(4, self.get, 'checkout')
+        self.assertEqual(response.context['order'].get_cart_items, CART_LINES * 2)
+
+    def test_update_item_authenticated(self):
+        self.login()
+        self.assertQueryBudget(14, self.post_json, 'update_item', {'productId': self.products[0].id, 'action': 'add'})
+        # A product not yet in the cart costs a savepoint and an insert.
+        self.assertQueryBudget(17, self.post_json, 'update_item', {'productId': self.products[-1].id, 'action': 'add'})
+
+    def test_update_item_rejects_bad_input(self):
+        for body in ('not json', '{"action": "add"}', '{"productId": "x", "action": "add"}', '[]'):
+            response = self.client.post(reverse('update_item'), body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_update_cart_batch_authenticated(self):
+        self.login()
+        # One UPDATE per product in the batch, independent of the cart size.
+        ops = [{'productId': product.id, 'action': 'add'} for product in self.products[:10]]
+        self.assertQueryBudget(23, self.post_json, 'update_cart', {'ops': ops})
+
+    def test_update_cart_guest(self):
+        self.set_guest_cart(CART_LINES)
+        ops = [{'productId': self.products[0].id, 'action': 'add'}]
+        self.assertQueryBudget(1, self.post_json, 'update_cart', {'ops': ops})
+
+    def test_order_history(self):
+        self.login()
+        response = self.assertQueryBudget(5, self.get, 'order_history')
+        self.assertEqual(len(response.context['orders']), 20)
+
+    def test_order_details(self):
+        self.login()
+        self.assertQueryBudget(6, self.get, 'order_details', self.open_order.id)
+
+
+class CartCookieTests(TestCase):
+    def request(self, value):
+        request = RequestFactory().get('/')
+        request.COOKIES[CART_COOKIE] = value
+        return request
+
+    def signed(self, value):
+        return get_cookie_signer(salt=CART_COOKIE + CART_COOKIE_SALT).sign(value)
+
+    def test_round_trip(self):
+        value = encodeCart({45: 1, 12: 3, 7: 0})
+        self.assertEqual(value, '1|12-3.45-1')
+        self.assertEqual(decodeCart(value), {12: 3, 45: 1})
+        self.assertEqual(readCartCookie(self.request(self.signed(value))), {12: 3, 45: 1})
+
+    def test_malformed_lines_and_versions_are_ignored(self):
+        self.assertEqual(decodeCart('1|12-3.x-1.13-.14--2'), {12: 3})
+        self.assertEqual(decodeCart('0|12-3'), {})
+
+    def test_tampered_cookie_is_an_empty_cart(self):
+        signed = self.signed(encodeCart({12: 3}))
+        self.assertEqual(readCartCookie(self.request(signed.replace('12-3', '12-9'))), {})
+
+    def test_oversize_cookie_is_an_empty_cart(self):
+        value = encodeCart({product_id: 1 for product_id in range(1000, 2000)})
+        self.assertGreater(len(value), CART_COOKIE_MAX_BYTES)
+        self.assertEqual(decodeCart(value), {})
+        self.assertEqual(readCartCookie(self.request(self.signed(value))), {})
+
+    def test_legacy_unsigned_cookie_is_an_empty_cart(self):
+        self.assertEqual(readCartCookie(self.request(json.dumps({'12': {'quantity': 5}}))), {})
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _local.update(version=None, rows=None)
+        self.addCleanup(_local.update, version=None, rows=None)
+
+    def names(self):
+        return [row['name'] for row in get_catalog()]
+
+    def test_rows_are_served_from_memory_until_the_version_moves(self):
+        Product.objects.create(name='Pen', price=2)
+        self.assertEqual(self.names(), ['Pen'])
+        version = catalog_version()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(), ['Pen'])
+        bump_catalog_version()
+        self.assertEqual(catalog_version(), version + 1)
+
+    def test_save_and_delete_invalidate(self):
+        pen = Product.objects.create(name='Pen', price=2)
+        self.assertEqual(self.names(), ['Pen'])
+        pen.name = 'Ballpoint'
+        pen.save()
+        self.assertEqual(self.names(), ['Ballpoint'])
+        pen.delete()
+        self.assertEqual(self.names(), [])
+
+
+class ProductListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Prices 1..25, charged as 10..250 rupees: one full page and one more.
+        Product.objects.bulk_create([
+            Product(name='Item %02d' % i, price=i, price_paise=Product.to_paise(i)) for i in range(1, 26)
+        ])
+
+    def get(self, **params):
+        return self.client.get(reverse('product_list'), params)
+
+    def test_pages_and_their_bounds(self):
+        data = self.get().json()
+        self.assertEqual((len(data['products']), data['page'], data['next_page']), (24, 1, 2))
+        data = self.get(page=2).json()
+        self.assertEqual(([row['name'] for row in data['products']], data['next_page']), (['Item 25'], None))
+        self.assertEqual(self.get(page=0).json()['page'], 1)
+        self.assertEqual(self.get(page=99).json(), {'products': [], 'page': 99, 'next_page': None})
+
+    def test_price_filter_and_sort(self):
+        data = self.get(min_price=20, max_price=50, sort='-price').json()
+        self.assertEqual([row['price_paise'] for row in data['products']], [5000, 4000, 3000, 2000])
+        self.assertIsNone(data['next_page'])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.get(page='two').status_code, 400)
+        self.assertEqual(self.get(sort='popularity').status_code, 400)
+
+
+class SearchTests(TestCase):
+    def search(self, q, **params):
+        response = self.client.get(reverse('search'), dict(params, q=q))
+        self.assertEqual(response.status_code, 200)
+        return [product.name for product in response.context['products']]
+
+    def test_index_follows_save_and_delete(self):
+        lamp = Product.objects.create(name='Brass desk lamp', price=40)
+        self.assertEqual(self.search('desk la'), ['Brass desk lamp'])
+        lamp.name = 'Copper floor lamp'
+        lamp.save()
+        self.assertEqual(self.search('desk'), [])
+        self.assertEqual(self.search('copp'), ['Copper floor lamp'])
+        lamp.delete()
+        self.assertEqual(self.search('lamp'), [])
+
+    def test_fts_syntax_is_treated_as_words(self):
+        Product.objects.create(name='Lamp', price=40)
+        self.assertEqual(fts_query('lamp OR "x* NEAR('), '"lamp"* "OR"* "x"* "NEAR"*')
+        self.assertEqual(self.search('lamp) OR ('), [])
+        self.assertEqual(self.search('  '), [])
+
+    def test_pages(self):
+        Product.objects.bulk_create([Product(name='Mug %d' % i, price=5) for i in range(25)])
+        rebuild_index()
+        self.assertEqual(len(self.search('mug')), 24)
+        response = self.client.get(reverse('search'), {'q': 'mug', 'page': 2})
+        self.assertEqual((len(response.context['products']), response.context['has_next']), (1, False))
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=directory.name))
+        self.dir = directory.name
+
+    def test_needs_variants_tracks_the_source(self):
+        product = Product(name='Lamp', image='lamp.png')
+        self.assertTrue(needs_variants(product))
+        product.image_variants = {'source': 'lamp.png'}
+        self.assertFalse(needs_variants(product))
+        product.image = None
+        self.assertTrue(needs_variants(product))
+        product.image_variants = {}
+        self.assertFalse(needs_variants(product))
+
+    def test_generates_bounded_jpeg_and_webp_copies(self):
+        Image.new('RGBA', (1600, 800), (200, 40, 40, 128)).save(os.path.join(self.dir, 'lamp.png'))
+        product = Product.objects.create(name='Lamp', price=40, image='lamp.png')
+        generate_product_variants(product.pk)
+
+        product.refresh_from_db()
+        self.assertFalse(needs_variants(product))
+        for name, size in IMAGE_VARIANTS.items():
+            entry = product.image_variants[name]
+            self.assertEqual((entry['width'], entry['height']), (size, size // 2))
+            for fmt in IMAGE_FORMATS:
+                self.assertTrue(os.path.exists(os.path.join(self.dir, entry[fmt])))
+        self.assertEqual(product.jpegSrcset.count('w, '), len(IMAGE_VARIANTS) - 1)
+        self.assertTrue(product.thumbnailURL.endswith('.jpg'))
+
+
+class AssetTests(TestCase):
+    def test_minify_css_keeps_quoted_strings(self):
+        source = '''
+            /* icons */
+            .tag::before { content: "a  b, c" ; }
+            .hero { background: url( "hero  image.png" ) ; font-family: 'Open  Sans' , serif }
+            .note::after { content: "/* not a comment */" }
+        '''
+        self.assertEqual(
+            minify_css(source),
+            '.tag::before{content:"a  b, c"}'
+            '.hero{background:url( "hero  image.png" );font-family:\'Open  Sans\',serif}'
+            '.note::after{content:"/* not a comment */"}',
+        )
+
+
+    def test_minify_js_keeps_line_breaks(self):
+        source = '''
+            // Update the cart badge
+            var count = 1
+            function show(n) {
+                return n  // inline comments stay
+            }
+        '''
+        self.assertEqual(
+            minify_js(source), 'var count = 1\nfunction show(n) {\nreturn n  // inline comments stay\n}\n',
+        )
+
+    def test_build_writes_hashed_bundles_and_manifest(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(_manifest.update, mtime=None, bundles={}, version='')
+        for name, content in (('a.css', 'a { color: red; }'), ('b.css', 'b { margin: 0 }'), ('c.js', 'go()\n')):
+            with open(os.path.join(directory.name, name), 'w') as f:
+                f.write(content)
+        self.enterContext(override_settings(
+            STATICFILES_DIRS=[directory.name], ASSET_BUILD_DIR=os.path.join(directory.name, 'dist'),
+            ASSET_BUNDLES={'site.css': ['a.css', 'b.css'], 'site.js': ['c.js']},
+        ))
+
+        # Until a build, pages link the sources.
+        self.assertEqual(bundle_urls('site.css'), ['/static/a.css', '/static/b.css'])
+        self.assertEqual(manifest_version(), '')
+
+        manifest, sizes = build_assets()
+        self.assertRegex(manifest['site.css'], r'^dist/site\.[0-9a-f]{12}\.css$')
+        path = os.path.join(directory.name, manifest['site.css'])
+        with open(path, 'rb') as f, open(path + '.gz', 'rb') as gz:
+            content = f.read()
+            self.assertEqual(content, b'a{color:red}\nb{margin:0}')
+            self.assertEqual(gzip.decompress(gz.read()), content)
+        self.assertEqual(sizes['site.css'], len(content))
+        self.assertEqual(bundle_urls('site.css'), ['/static/' + manifest['site.css']])
+        self.assertIn('<script type="text/javascript" src="/static/dist/site.', bundle_tags('site.js'))
+        self.assertEqual(len(manifest_version()), 8)
+
+
+class OrderHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('historian', password='secret-pass-123')
+        # One page and one more, all placed at the same instant so only the
+        # id breaks ties.
+        orders = Order.objects.bulk_create([
+            Order(customer=cls.user.customer, complete=True) for i in range(ORDER_HISTORY_PAGE_SIZE + 1)
+        ])
+        Order.objects.update(date_order=timezone.now())
+        cls.ids = sorted((order.id for order in orders), reverse=True)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def page(self, before=None):
+        response = self.client.get(reverse('order_history'), {'before': before} if before else {})
+        return [order.id for order in response.context['orders']], response.context['next_cursor']
+
+    def test_cursor_round_trip(self):
+        order = Order.objects.get(pk=self.ids[0])
+        self.assertEqual(parseOrderCursor(orderCursor(order)), (order.date_order, order.id))
+        self.assertIsNone(parseOrderCursor('yesterday'))
+        self.assertIsNone(parseOrderCursor(None))
+
+    def test_pages_follow_the_cursor_to_the_end(self):
+        first, cursor = self.page()
+        self.assertEqual(first, self.ids[:ORDER_HISTORY_PAGE_SIZE])
+        self.assertEqual(cursor, orderCursor(Order.objects.get(pk=first[-1])))
+        rest, cursor = self.page(cursor)
+        self.assertEqual(rest, self.ids[ORDER_HISTORY_PAGE_SIZE:])
+        self.assertIsNone(cursor)
+
+    def test_exactly_one_page_has_no_next_cursor(self):
+        Order.objects.filter(pk=self.ids[-1]).delete()
+        self.assertEqual(self.page(), (self.ids[:-1], None))
+
+    def test_bad_cursor_starts_from_the_newest(self):
+        self.assertEqual(self.page('not-a-cursor')[0], self.ids[:ORDER_HISTORY_PAGE_SIZE])
+
+
+class ImportCatalogTests(TestCase):
+    def import_rows(self, text, suffix='.csv'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_catalog', f.name, workers=0, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_creates_then_updates_by_sku(self):
+        self.import_rows('sku,name,price,digital\nA1,Mug,12.5,no\nB2,E-book,3,yes\n')
+        mug = Product.objects.get(sku='A1')
+        self.assertEqual((mug.price, mug.price_paise, mug.digital), (12.5, Product.to_paise(12.5), False))
+        self.assertTrue(Product.objects.get(sku='B2').digital)
+
+        out, err = self.import_rows('{"sku": "A1", "name": "Mug", "price": 20}\n', suffix='.jsonl')
+        self.assertIn('0 created, 1 updated', out)
+        self.assertEqual(Product.objects.get(sku='A1').price_paise, Product.to_paise(20))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_reports_invalid_rows(self):
+        out, err = self.import_rows('sku,name,price\n,No sku,1\nC3,Bad price,abc\nD4,Fine,1\n')
+        self.assertIn('Line 2: missing sku', err)
+        self.assertIn("Line 3: invalid price 'abc'", err)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['D4'])
+
+
+class ExportOrdersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('finance', password='secret-pass-123', is_staff=True)
+        product = Product.objects.create(name='Lamp', price=25, sku='L1')
+        customer = Customer.objects.create(name='Asha', email='asha@example.com')
+        cls.order = Order.objects.create(customer=customer, complete=True, transaction_id='T1')
+        OrderItem.objects.create(order=cls.order, product=product, quantity=2)
+
+    def test_requires_staff(self):
+        response = self.client.get(reverse('export_orders'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_streams_csv_lines(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_orders'), {'since': '2000-01-01'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('T1', lines[1])
+        self.assertIn('L1,Lamp,2,%d,%d' % (Product.to_paise(25) // 100, Product.to_paise(25) // 50), lines[1])
+
+    def test_jsonl_date_filter(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_orders'), {'format': 'jsonl', 'until': '2000-01-01'})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+        response = self.client.get(reverse('export_orders'), {'format': 'jsonl'})
+        record = json.loads(b''.join(response.streaming_content))
+        self.assertEqual((record['order_id'], record['order_items']), (self.order.id, 2))
+
+    def test_rejects_bad_dates(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_orders'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class AdminChangelistTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123')
+        customer = Customer.objects.create(name='Ravi')
+        product = Product.objects.create(name='Pen', price=2)
+        orders = Order.objects.bulk_create([Order(customer=customer, complete=True) for i in range(150)])
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=3) for order in orders])
+        Order.objects.recompute_totals()
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_order_changelist(self):
+        response = self.assertQueryBudget(4, self.get, reverse('admin:store_order_changelist'))
+        orders = response.context['cl'].result_list
+        self.assertEqual(len(orders), 100)
+        self.assertEqual(orders[0].get_cart_items, 3)
+
+    def test_orderitem_changelist(self):
+        self.assertQueryBudget(4, self.get, reverse('admin:store_orderitem_changelist'))
+
+    def test_order_number_search(self):
+        order = Order.objects.order_by('id').first()
+        response = self.get(reverse('admin:store_order_changelist'), {'q': str(order.id)})
+        self.assertEqual(list(response.context['cl'].result_list), [order])
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'secret-pass-123')
+        cls.pen = Product.objects.create(name='Pen', price=2)
+        cls.book = Product.objects.create(name='Book', price=30, digital=True)
+
+    def form(self, key='key-1', **overrides):
+        data = {
+            'name': 'Buyer', 'email': 'buyer@example.com', 'street': '1 Main St', 'city': 'Pune',
+            'state': 'MH', 'pincode': '411001', 'payment_method': 'cod', 'idempotency_key': key,
+        }
+        data.update(overrides)
+        return data
+
+    def fill_cart(self):
+        order = Order.objects.create(customer=self.user.customer)
+        OrderItem.objects.create(order=order, product=self.pen, quantity=3)
+        OrderItem.objects.create(order=order, product=self.book, quantity=1)
+        Order.objects.filter(pk=order.pk).recompute_totals()
+        return order
+
+    def test_places_order_once(self):
+        self.client.force_login(self.user)
+        cart = self.fill_cart()
+
+        response = self.client.post(reverse('order'), self.form())
+        self.assertRedirects(response, reverse('order_details', args=[cart.id]))
+        order = Order.objects.get(pk=cart.pk)
+        expected = self.pen.price_in_rupees * 3 + self.book.price_in_rupees
+        self.assertTrue(order.complete)
+        self.assertEqual(order.total, expected)
+        self.assertEqual((order.city, order.zipcode, order.payment_method), ('Pune', '411001', 'cod'))
+        self.assertTrue(order.transaction_id)
+        self.assertIsNotNone(order.completed_at)
+        self.assertEqual(UserAddress.objects.count(), 1)
+
+        # A double submit finds the placed order and changes nothing.
+        with QueryRecorder() as recorder:
+            response = self.client.post(reverse('order'), self.form())
+        self.assertRedirects(response, reverse('order_details', args=[cart.id]), fetch_redirect_response=False)
+        self.assertLessEqual(recorder.count, 4)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(UserAddress.objects.count(), 1)
+
+    def test_line_prices_are_snapshotted(self):
+        self.client.force_login(self.user)
+        cart = self.fill_cart()
+        self.client.post(reverse('order'), self.form())
+
+        self.pen.price = 500
+        self.pen.save()
+        order = Order.objects.get(pk=cart.pk)
+        self.assertEqual(order.get_cart_total, order.total)
+
+    def test_guest_checkout_clears_cookie(self):
+        signer = get_cookie_signer(salt=CART_COOKIE + CART_COOKIE_SALT)
+        self.client.cookies[CART_COOKIE] = signer.sign(encodeCart({self.pen.id: 2}))
+
+        response = self.client.post(reverse('order'), self.form(key='guest-1'))
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(idempotency_key='guest-1')
+        self.assertTrue(order.complete)
+        self.assertEqual(order.total, self.pen.price_in_rupees * 2)
+        self.assertEqual(response.cookies[CART_COOKIE].value, '')
+
+        self.client.cookies[CART_COOKIE] = signer.sign(encodeCart({self.pen.id: 2}))
+        self.client.post(reverse('order'), self.form(key='guest-1'))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_empty_cart_is_rejected(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('order'), self.form())
+        self.assertRedirects(response, reverse('checkout'))
+        self.assertFalse(Order.objects.exists())
+
+    def test_missing_key_is_rejected(self):
+        self.client.force_login(self.user)
+        cart = self.fill_cart()
+        response = self.client.post(reverse('order'), self.form(key=''))
+        self.assertRedirects(response, reverse('checkout'))
+        self.assertFalse(Order.objects.get(pk=cart.pk).complete)
+
+
+class OrderTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('keeper', password='secret-pass-123')
+        cls.pen = Product.objects.create(name='Pen', price=2)
+        cls.book = Product.objects.create(name='Book', price=30, digital=True)
+
+    def update(self, *ops):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('update_cart'), json.dumps({'ops': list(ops)}),
+                                    content_type='application/json')
+        return response.json()['cart']
+
+    def test_cart_updates_maintain_totals(self):
+        self.update({'productId': self.pen.id, 'action': 'add'}, {'productId': self.book.id, 'action': 'add'})
+        cart = self.update({'productId': self.pen.id, 'action': 'set', 'quantity': 4},
+                           {'productId': self.book.id, 'action': 'remove'})
+        order = Order.objects.get()
+        self.assertEqual((order.item_count, order.total), (4, 80))
+        self.assertEqual((cart['items'], cart['total']), (4, 80))
+
+    def test_removing_from_no_cart_creates_no_order(self):
+        cart = self.update({'productId': self.pen.id, 'action': 'remove'}, {'productId': 999999, 'action': 'add'})
+        self.assertEqual((cart['items'], cart['total']), (0, 0))
+        self.assertFalse(Order.objects.exists())
+
+    def test_price_change_refreshes_open_carts(self):
+        self.update({'productId': self.pen.id, 'action': 'set', 'quantity': 3})
+        self.pen.price = 5
+        self.pen.save()
+        self.assertEqual(Order.objects.get().total, 150)
+
+    def test_deleting_a_product_refreshes_open_carts(self):
+        self.update({'productId': self.pen.id, 'action': 'set', 'quantity': 3},
+                    {'productId': self.book.id, 'action': 'add'})
+        Product.objects.get(pk=self.book.pk).delete()
+        order = Order.objects.get()
+        stored = (order.item_count, order.total)
+        Order.objects.filter(pk=order.pk).recompute_totals()
+        order.refresh_from_db()
+        self.assertEqual(stored, (order.item_count, order.total))
+        self.assertEqual(order.total, 60)
+
+    def test_other_product_edits_leave_carts_alone(self):
+        self.update({'productId': self.pen.id, 'action': 'set', 'quantity': 3})
+        Order.objects.update(total=1)
+        pen = Product.objects.get(pk=self.pen.pk)
+        pen.name = 'Ballpoint'
+        pen.save()
+        self.assertEqual(Order.objects.get().total, 1)
+
+    def test_reconcile_repairs_drift(self):
+        self.update({'productId': self.pen.id, 'action': 'set', 'quantity': 3})
+        Order.objects.update(item_count=7, total=1)
+        out = io.StringIO()
+        call_command('reconcile_order_totals', dry_run=True, stdout=out)
+        self.assertIn('1 drifted', out.getvalue())
+        call_command('reconcile_order_totals', stdout=io.StringIO())
+        order = Order.objects.get()
+        self.assertEqual((order.item_count, order.total), (3, 60))
+
+
+class SalesRollupTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.pen = Product.objects.create(name='Pen', price=2)
+        cls.book = Product.objects.create(name='Book', price=30, digital=True)
+        cls.day = timezone.now() - datetime.timedelta(days=2)
+
+    def place(self, completed_at, *lines):
+        order = Order.objects.create(complete=True, completed_at=completed_at)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=quantity, price_paise=product.price_paise)
+            for product, quantity in lines
+        ])
+        Order.objects.filter(pk=order.pk).recompute_totals()
+        return order
+
+    def test_refresh_folds_each_order_once(self):
+        self.place(self.day, (self.pen, 3), (self.book, 1))
+        self.place(self.day, (self.pen, 1))
+        self.assertEqual(refresh_sales_rollups(batch_size=1), 2)
+        self.assertEqual(refresh_sales_rollups(), 0)
+
+        self.place(self.day + datetime.timedelta(hours=1), (self.book, 2))
+        self.assertEqual(refresh_sales_rollups(), 1)
+
+        day = DailySales.objects.get()
+        self.assertEqual((day.orders, day.units, day.revenue), (3, 7, 80 + 900))
+        pen = DailyProductSales.objects.get(product=self.pen)
+        self.assertEqual((pen.orders, pen.units, pen.revenue), (2, 4, 80))
+
+    def test_recent_orders_wait_for_the_lag(self):
+        self.place(timezone.now(), (self.pen, 1))
+        self.assertEqual(refresh_sales_rollups(), 0)
+        self.assertEqual(refresh_sales_rollups(now=timezone.now() + datetime.timedelta(minutes=5)), 1)
+
+    def test_orders_completed_in_admin_are_stamped(self):
+        order = Order.objects.create()
+        order.complete = True
+        admin.site._registry[Order].save_model(None, order, None, True)
+        self.assertIsNotNone(Order.objects.get().completed_at)
+
+    def test_dashboard_reads_only_rollups(self):
+        for i in range(20):
+            self.place(self.day - datetime.timedelta(days=i), (self.pen, 1), (self.book, 1))
+        call_command('refresh_sales_rollups', stdout=io.StringIO())
+        self.client.force_login(User.objects.create_superuser('boss', 'boss@example.com', 'secret-pass-123'))
+        response = self.assertQueryBudget(7, self.client.get, reverse('sales_dashboard'), {'days': 365})
+        self.assertEqual(response.context['totals']['orders'], 20)
+        self.assertEqual([row['product__name'] for row in response.context['products']], ['Book', 'Pen'])
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_jobs_run_by_priority_and_are_deleted(self):
+        record_call.enqueue('low')
+        record_call.enqueue('high', priority=5)
+        for pk, token in claim(10):
+            self.assertTrue(run_job(pk, token))
+        self.assertEqual(CALLS, ['high', 'low'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_failures_back_off_then_fail(self):
+        job = always_fails.enqueue()
+        [(pk, token)] = claim(1)
+        with self.assertLogs('store.jobs', 'WARNING'):
+            self.assertFalse(run_job(pk, token))
+        job.refresh_from_db()
+        self.assertEqual((job.state, job.attempts), (Job.QUEUED, 1))
+        self.assertEqual(claim(1), [])
+
+        [(pk, token)] = claim(1, now=job.available_at)
+        with self.assertLogs('store.jobs', 'WARNING'):
+            run_job(pk, token)
+        job.refresh_from_db()
+        self.assertEqual(job.state, Job.FAILED)
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+    def test_expired_lease_is_claimed_again(self):
+        job = record_call.enqueue('once')
+        [(pk, stale)] = claim(1)
+        [(pk, token)] = claim(1, now=timezone.now() + datetime.timedelta(seconds=job.timeout + 1))
+        self.assertFalse(run_job(pk, stale))
+        self.assertTrue(run_job(pk, token))
+        self.assertEqual(CALLS, ['once'])
+
+    def test_process_pool_runs_jobs_in_child_processes(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'pid')
+        write_pid.enqueue(path)
+        out = io.StringIO()
+        call_command('run_worker', pool='process', concurrency=1, burst=True, poll_interval=0.1, stdout=out)
+        self.assertIn('Ran 1 job(s), 0 failed.', out.getvalue())
+        with open(path) as f:
+            self.assertNotEqual(int(f.read()), os.getpid())
+
+    def test_image_upload_enqueues_derivatives(self):
+        product = Product.objects.create(name='Lamp', price=40, image='lamp.jpg')
+        job = Job.objects.get()
+        self.assertEqual((job.task, job.args), ('store.images.generate_product_variants', [product.pk]))
+
+    @override_settings(STORE_JOBS_EAGER=True)
+    def test_eager_mode_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_call.enqueue('now')
+            self.assertEqual(CALLS, [])
+        self.assertEqual(CALLS, ['now'])
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(THROTTLE_RATES={
+    'login': {'ip': '2/min'},
+    'update_cart': {'ip': '100/min', 'user': '1/min'},
+})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        _backend.clear()
+
+    def bucket_file(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return os.path.join(directory.name, 'buckets')
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('30/10s'), (30, 3.0))
+        self.assertEqual(parse_rate('6/min'), (6, 0.1))
+
+    def test_ip_limit_answers_without_queries(self):
+        for i in range(2):
+            self.assertEqual(self.client.post(reverse('login'), {'username': 'x'}).status_code, 200)
+        with QueryRecorder() as recorder:
+            response = self.client.post(reverse('login'), {'username': 'x'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+        self.assertEqual(recorder.count, 0)
+        # Reading the page is never limited.
+        self.assertEqual(self.client.get(reverse('login')).status_code, 200)
+
+    def test_user_limit_spans_addresses(self):
+        self.client.force_login(User.objects.create_user('busy', password='secret-pass-123'))
+        payload = json.dumps({'ops': []})
+        first = self.client.post(reverse('update_cart'), payload, content_type='application/json',
+                                 REMOTE_ADDR='10.0.0.1')
+        second = self.client.post(reverse('update_cart'), payload, content_type='application/json',
+                                  REMOTE_ADDR='10.0.0.2')
+        self.assertNotEqual(first.status_code, 429)
+        self.assertEqual(second.status_code, 429)
+        self.assertIn('error', second.json())
+
+    def test_buckets_refill(self):
+        for backend in (LocalBuckets(), FileBuckets(self.bucket_file(), slots=64)):
+            self.assertEqual(backend.take('k', 2, 1.0, now=100), 0)
+            self.assertEqual(backend.take('k', 2, 1.0, now=100), 0)
+            self.assertEqual(backend.take('k', 2, 1.0, now=100), 1.0)
+            self.assertEqual(backend.take('k', 2, 1.0, now=101), 0)
+
+    def test_file_buckets_are_shared(self):
+        path = self.bucket_file()
+        FileBuckets(path).take('k', 1, 0.1, now=100)
+        self.assertEqual(FileBuckets(path).take('k', 1, 0.1, now=100), 10.0)
+
+
+class PrerenderTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PRERENDER_DIR=directory.name, PRERENDER_CHECK_SECONDS=0))
+        _pages.clear()
+        self.addCleanup(_pages.clear)
+        self.out = io.StringIO()
+        call_command('prerender_pages', stdout=self.out)
+        self.dir = directory.name
+
+    def test_serves_precompressed_page_without_queries(self):
+        # A query string opts out, giving the page as the view renders it.
+        rendered = self.client.get(reverse('faq'), {'from': 'footer'}).content
+        with QueryRecorder() as recorder:
+            response = self.client.get(reverse('faq'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(recorder.count, 0)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), rendered)
+
+        response = self.client.get(reverse('faq'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_personal_requests_render_normally(self):
+        user = User.objects.create_user('reader', password='secret-pass-123')
+        self.client.force_login(user)
+        self.assertContains(self.client.get(reverse('about_us')), 'reader')
+        self.assertFalse(self.client.get(reverse('about_us')).has_header('ETag'))
+
+    def test_visitors_with_queued_messages_get_the_view(self):
+        request = RequestFactory().get(reverse('faq'))
+        request.user = AnonymousUser()
+        request.cart = Cart(request)
+        request._messages = CookieStorage(request)
+        messages.info(request, 'See you soon')
+        self.assertFalse(views.faq(request).has_header('ETag'))
+
+    def test_pages_with_forms_are_not_prerendered(self):
+        self.assertIn('contact_us   skipped', self.out.getvalue())
+        response = self.client.get(reverse('contact_us'))
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_compressed_copies_match_the_page(self):
+        # A copy left by an earlier build of different content.
+        with open(os.path.join(self.dir, 'faq.0123abcd.html.gz'), 'wb') as f:
+            f.write(gzip.compress(b'old'))
+        path = os.path.join(self.dir, 'faq.html')
+        os.utime(path, (0, 0))
+        self.client.get(reverse('faq'))
+        copies = [name for name in os.listdir(self.dir) if name.startswith('faq.') and name.endswith('.gz')]
+        self.assertEqual(len(copies), 1)
+        with open(path, 'rb') as f, open(os.path.join(self.dir, copies[0]), 'rb') as gz:
+            self.assertEqual(gzip.decompress(gz.read()), f.read())
+
+    def test_a_rebuild_does_not_hold_up_other_pages(self):
+        os.utime(os.path.join(self.dir, 'blog.html'), (0, 0))
+        with ThreadPoolExecutor(1) as pool, _locks['faq']:
+            # As if faq were being rebuilt.
+            page = pool.submit(load_page, 'blog').result(timeout=10)
+        self.assertIsNotNone(page)
+
+    def test_rebuilt_when_older_than_templates(self):
+        path = os.path.join(self.dir, 'blog.html')
+        os.utime(path, (0, 0))
+        self.assertTrue(self.client.get(reverse('blog')).has_header('ETag'))
+        self.assertGreater(os.stat(path).st_mtime, 0)
+
+
+class InventoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Console', price=300)
+
+    def test_reserve_spans_buckets_and_never_oversells(self):
+        set_stock(self.product, 10, buckets=4)
+        holds = reserve(self.product.id, 9)
+        self.assertEqual(sum(hold.quantity for hold in holds), 9)
+        self.assertEqual(available(self.product), 1)
+        with self.assertRaises(OutOfStock):
+            reserve(self.product.id, 2)
+        self.assertEqual(available(self.product), 1)
+
+    def test_reserve_rereads_buckets_changed_meanwhile(self):
+        set_stock(self.product, 8, buckets=4)
+        take = inventory._take
+
+        def moved_first(product_id, bucket, quantity):
+            # Another writer shifts stock between buckets after they were read.
+            if not moved:
+                moved.append(True)
+                StockBucket.objects.filter(product=self.product, bucket=0).update(quantity=0)
+                StockBucket.objects.filter(product=self.product, bucket=1).update(quantity=4)
+            return take(product_id, bucket, quantity)
+
+        moved = []
+        with mock.patch('store.inventory.random.randrange', return_value=0), \
+                mock.patch('store.inventory._take', side_effect=moved_first):
+            holds = reserve(self.product.id, 8)
+        self.assertEqual(sum(hold.quantity for hold in holds), 8)
+        self.assertEqual(available(self.product), 0)
+
+    def test_expired_holds_are_released_once(self):
+        set_stock(self.product, 5, buckets=1)
+        holds = reserve(self.product.id, 3, ttl=datetime.timedelta(seconds=-1))
+        self.assertEqual(release_expired(), 1)
+        self.assertEqual(release_expired(), 0)
+        self.assertEqual(release(holds), 0)
+        self.assertEqual(available(self.product), 5)
+
+    def test_set_stock_counts_held_stock(self):
+        set_stock(self.product, 5, buckets=4)
+        holds = reserve(self.product.id, 3)
+        set_stock(self.product, 4, buckets=1)
+        self.assertEqual(available(self.product), 1)
+        with self.assertRaises(ValueError):
+            set_stock(self.product, 2)
+        release(holds)
+        self.assertEqual(available(self.product), 4)
+
+    def test_checkout_commits_cart_holds(self):
+        set_stock(self.product, 2)
+        user = User.objects.create_user('gamer', password='secret-pass-123')
+        self.client.force_login(user)
+        ops = [{'productId': self.product.id, 'action': 'set', 'quantity': 3}]
+        response = self.client.post(reverse('update_cart'), json.dumps({'ops': ops}), content_type='application/json')
+        # More than is in stock cannot be held, and checkout refuses it.
+        self.assertEqual(response.json()['lines'][0]['available'], 2)
+        self.assertEqual(available(self.product), 2)
+        form = {'name': 'Gamer', 'email': 'g@example.com', 'idempotency_key': 'k'}
+        response = self.client.post(reverse('order'), form)
+        self.assertRedirects(response, reverse('checkout'))
+
+        ops = [{'productId': self.product.id, 'action': 'set', 'quantity': 2}]
+        self.client.post(reverse('update_cart'), json.dumps({'ops': ops}), content_type='application/json')
+        self.assertEqual(available(self.product), 0)
+        self.client.post(reverse('order'), form)
+        self.assertEqual(set(Reservation.objects.values_list('state', flat=True)), {Reservation.COMMITTED})
+        self.assertTrue(Order.objects.get().complete)
+
+    def test_shrinking_a_cart_returns_only_the_difference(self):
+        set_stock(self.product, 5, buckets=1)
+        user = User.objects.create_user('gamer', password='secret-pass-123')
+        self.client.force_login(user)
+        for quantity in (4, 1):
+            ops = [{'productId': self.product.id, 'action': 'set', 'quantity': quantity}]
+            self.client.post(reverse('update_cart'), json.dumps({'ops': ops}), content_type='application/json')
+        self.assertEqual(available(self.product), 4)
+        hold = Reservation.objects.get(state=Reservation.HELD)
+        self.assertEqual(hold.quantity, 1)
+
+
+class StockContentionTests(TransactionTestCase):
+    # Real threads and connections racing for one product.
+    BUYERS = 300
+    STOCK = 120
+
+    def test_parallel_buyers_never_oversell(self):
+        product = Product.objects.create(name='Flash sale', price=99)
+        set_stock(product, self.STOCK)
+
+        def buy(i):
+            try:
+                for attempt in range(50):
+                    try:
+                        return bool(reserve(product.id, 1))
+                    except OperationalError as e:
+                        # Shared-cache in-memory test databases report lock
+                        # conflicts immediately instead of waiting.
+                        if not is_locked_error(e):
+                            raise
+                        time.sleep(0.001 * (attempt + 1))
+                raise AssertionError('buyer %d never got the lock' % i)
+            except OutOfStock:
+                return False
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        # reserve() logs a warning for each retry after a lock conflict; how
+        # many there are depends on timing, so they are kept out of the output
+        # without being counted.
+        with mock.patch('store.db.logger'), ThreadPoolExecutor(32) as pool:
+            results = list(pool.map(buy, range(self.BUYERS)))
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(sum(results), self.STOCK)
+        self.assertEqual(available(product), 0)
+        self.assertEqual(
+            Reservation.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'], self.STOCK,
+        )
+        self.assertLess(elapsed, 30)
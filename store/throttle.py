@@ -0,0 +1,115 @@
+import collections
+import functools
+import hashlib
+import os
+import re
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Token buckets keyed by client. A bucket holds up to `capacity` tokens and
+# refills at `rate` tokens per second; each request takes one. Rates are
+# written 'N/period' (period s, m or h, optionally prefixed by a count,
+# e.g. '20/10s'): N requests in a burst, refilled over the period.
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+RATE_RE = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smh])[a-z]*\s*$')
+
+
+@functools.lru_cache(maxsize=None)
+def parse_rate(rate):
+    match = RATE_RE.match(rate)
+    if not match:
+        raise ImproperlyConfigured('Invalid throttle rate %r; expected e.g. "10/s" or "30/min"' % rate)
+    count, multiplier, unit = match.groups()
+    seconds = int(multiplier or 1) * PERIODS[unit]
+    return int(count), int(count) / seconds
+
+
+def _refill(tokens, stamp, capacity, rate, now):
+    return min(capacity, tokens + (now - stamp) * rate)
+
+
+class LocalBuckets:
+    # Buckets in this process's memory: exact per worker, but each worker
+    # of a multi-process server keeps its own.
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.buckets = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, rate, now=None):
+        """Take a token and return 0, or return the seconds until one is
+        available."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, stamp = self.buckets.pop(key, (capacity, now))
+            tokens = _refill(tokens, stamp, capacity, rate, now)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+            if len(self.buckets) > self.max_keys:
+                # Forget the least recently seen client.
+                self.buckets.popitem(last=False)
+            return wait
+
+
+class FileBuckets:
+    # Buckets in a fixed-size file shared by every worker process on the
+    # host. Each key hashes to one slot, which is updated under an fcntl
+    # lock on just its bytes (plus a thread lock, as fcntl locks do not
+    # exclude threads of one process). A slot taken over by another key starts it
+    # with a full bucket, so a collision can only let a client through.
+    SLOT = struct.Struct('<8sdd')
+
+    def __init__(self, path=None, slots=65536):
+        # POSIX only; imported here so LocalBuckets still works elsewhere.
+        import fcntl
+        self.fcntl = fcntl
+        self.path = path or getattr(settings, 'THROTTLE_FILE', None) or os.path.join(
+            settings.BASE_DIR, 'throttle.buckets',
+        )
+        self.slots = slots
+        self.lock = threading.Lock()
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self.fd).st_size < slots * self.SLOT.size:
+            os.ftruncate(self.fd, slots * self.SLOT.size)
+
+    def take(self, key, capacity, rate, now=None):
+        # Wall-clock time, as monotonic clocks are not comparable between
+        # processes.
+        now = time.time() if now is None else now
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        offset = int.from_bytes(digest, 'little') % self.slots * self.SLOT.size
+
+        with self.lock:
+            self.fcntl.lockf(self.fd, self.fcntl.LOCK_EX, self.SLOT.size, offset)
+            try:
+                owner, tokens, stamp = self.SLOT.unpack(os.pread(self.fd, self.SLOT.size, offset))
+                if owner != digest:
+                    tokens, stamp = capacity, now
+                tokens = _refill(tokens, stamp, capacity, rate, now)
+                wait = 0 if tokens >= 1 else (1 - tokens) / rate
+                os.pwrite(self.fd, self.SLOT.pack(digest, tokens - 1 if not wait else tokens, now), offset)
+            finally:
+                self.fcntl.lockf(self.fd, self.fcntl.LOCK_UN, self.SLOT.size, offset)
+        return wait
+
+
+_backend = {}
+
+
+def get_backend():
+    path = getattr(settings, 'THROTTLE_BACKEND', 'store.throttle.LocalBuckets')
+    if path not in _backend:
+        _backend[path] = import_string(path)()
+    return _backend[path]
+
+
+def throttle_rates(url_name):
+    """{'ip': (capacity, rate), 'user': (capacity, rate)} for a URL name,
+    with either key absent when that scope is not limited."""
+    rates = getattr(settings, 'THROTTLE_RATES', {}).get(url_name) or {}
+    return {scope: parse_rate(rate) for scope, rate in rates.items()}
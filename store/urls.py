@@ -5,9 +5,12 @@ urlpatterns = [
 
         path('', views.store, name="store"),
         path('store/', views.store, name="store"),
+        path('products/', views.product_list, name="product_list"),
+        path('search/', views.search, name="search"),
         path('cart/', views.cart, name="cart"),
         path('checkout/', views.checkout, name="checkout"),
         path('update_item/', views.updateItem, name="update_item"),
+        path('cart/update/', views.updateCart, name="update_cart"),
         path('track_order/', views.track_order, name="track_order"),
         path('register/', views.register, name="register"),
         path('navbar/', views.navbar, name="navbar"),
@@ -25,6 +28,9 @@ urlpatterns = [
         path('career/', views.career, name="career"),
         path('profile/', views.profile, name="profile"),
         path('order_history/', views.order_history, name='order_history'),
+        path('order_history/<int:order_id>/', views.order_details, name='order_details'),
+        path('orders/export/', views.export_orders, name='export_orders'),
+        path('reports/sales/', views.sales_dashboard, name='sales_dashboard'),
         path('update_profile/', views.update_profile, name='update_profile'),
         path('update_password/', views.update_password, name='update_password'),
         path('order/', views.order, name='order'),
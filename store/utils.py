@@ -1,59 +1,104 @@
-import json
+import datetime
+from django.db import transaction
 from .models import *
 
-def cookieCart(request):
+# Guest carts are kept in a signed cookie written only by the server. The
+# payload is "<version>|<id>-<qty>.<id>-<qty>", e.g. "1|12-3.45-1".
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'store.cart'
+CART_COOKIE_VERSION = '1'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Browsers drop cookies over 4 KB, so a longer value was not sent by one.
+CART_COOKIE_MAX_BYTES = 4096
+
+def encodeCart(cart):
+    lines = '.'.join('%d-%d' % (productId, quantity) for productId, quantity in sorted(cart.items()) if quantity > 0)
+    return CART_COOKIE_VERSION + '|' + lines
+
+def decodeCart(value):
+    if len(value) > CART_COOKIE_MAX_BYTES:
+        return {}
+    version, _, lines = value.partition('|')
+    if version != CART_COOKIE_VERSION:
+        return {}
+
+    cart = {}
+    for line in filter(None, lines.split('.')):
+        productId, _, quantity = line.partition('-')
+        try:
+            productId, quantity = int(productId), int(quantity)
+        except ValueError:
+            continue
+        if quantity > 0:
+            cart[productId] = quantity
+    return cart
+
+def readCartCookie(request):
+    # Parsed once per request; callers must not mutate the returned dict. An
+    # unsigned or tampered cookie, including the JSON one cart.js used to
+    # write, reads as an empty cart.
+    if not hasattr(request, '_cart_cookie'):
+        value = request.get_signed_cookie(CART_COOKIE, default=None, salt=CART_COOKIE_SALT)
+        request._cart_cookie = decodeCart(value) if value is not None else {}
+    return request._cart_cookie
+
+def writeCartCookie(response, cart):
+    response.set_signed_cookie(
+        CART_COOKIE, encodeCart(cart), salt=CART_COOKIE_SALT,
+        max_age=CART_COOKIE_MAX_AGE, httponly=True, samesite='Lax',
+    )
+
+# Order history pages are keyed on (date_order, id), newest first. A cursor
+# is the position of the last order on the previous page.
+ORDER_CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+def orderCursor(order):
+    date_order = order.date_order.astimezone(datetime.timezone.utc)
+    return '%s-%d' % (date_order.strftime(ORDER_CURSOR_FORMAT), order.id)
+
+def parseOrderCursor(cursor):
     try:
-        cart = json.loads(request.COOKIES['cart'])
-    except:
-        cart = {}
-        print('CART:', cart)
+        date_order, order_id = cursor.split('-')
+        date_order = datetime.datetime.strptime(date_order, ORDER_CURSOR_FORMAT)
+        return date_order.replace(tzinfo=datetime.timezone.utc), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+
+def cookieCart(request, cart=None):
+    if cart is None:
+        cart = readCartCookie(request)
 
     items = []
     order = {'get_cart_total': 0, 'get_cart_items': 0, 'shipping': False}
     cartItems = order['get_cart_items']
 
-    for i in cart:
-        try:
-            if cart[i]['quantity'] > 0:
-                cartItems += cart[i]['quantity']
-
-                product = Product.objects.get(id=i)
-                total = product.price_in_rupees() * 10 * cart[i]['quantity']  # Use price_in_rupees
+    products = Product.objects.in_bulk(list(cart))
+    for productId, quantity in cart.items():
+        product = products.get(productId)
+        if product is None:
+            continue
 
-                order['get_cart_total'] += total
-                order['get_cart_items'] += cart[i]['quantity']
+        cartItems += quantity
+        total = product.price_in_rupees * quantity
 
-                item = {
-                    'id': product.id,
-                    'product': {'id': product.id, 'name': product.name, 'price': product.price_in_rupees, 'imageURL': product.imageURL},
-                    'quantity': cart[i]['quantity'],
-                    'digital': product.digital,
-                    'get_total': total,
-                }
-                items.append(item)
+        order['get_cart_total'] += total
+        order['get_cart_items'] += quantity
 
-                if not product.digital:
-                    order['shipping'] = True
-        except:
-            pass
-
-    return {'cartItems': cartItems, 'order': order, 'items': items}
+        item = {
+            'id': product.id,
+            'product': {
+                'id': product.id, 'name': product.name, 'price': product.price_in_rupees,
+                'price_in_rupees': product.price_in_rupees, 'imageURL': product.imageURL,
+                'thumbnailURL': product.thumbnailURL,
+            },
+            'quantity': quantity,
+            'digital': product.digital,
+            'get_total': total,
+        }
+        items.append(item)
 
-def cartData(request):
-    if request.user.is_authenticated:
-        user = request.user
-        if not hasattr(user, 'customer'):
-            Customer.objects.create(user=user, name=user.username, email=user.email)
-        
-        customer = user.customer
-        order, created = Order.objects.get_or_create(customer=customer, complete=False)
-        items = order.orderitem_set.all()
-        cartItems = order.get_cart_items
-    else:
-        cookieData = cookieCart(request)
-        cartItems = cookieData['cartItems']
-        order = cookieData['order']
-        items = cookieData['items']
+        if product.digital == False:
+            order['shipping'] = True
 
     return {'cartItems': cartItems, 'order': order, 'items': items}
 
@@ -61,25 +106,31 @@ def guestOrder(request, data):
     name = data['form']['name']
     email = data['form']['email']
 
-    cookieData = cookieCart(request)
-    items = cookieData['items']
+    cart = readCartCookie(request)
+    products = Product.objects.in_bulk(list(cart))
+    items = [
+        OrderItem(product=products[productId], quantity=quantity, price_paise=products[productId].price_paise)
+        for productId, quantity in cart.items() if productId in products
+    ]
 
-    customer, created = Customer.objects.get_or_create(
-        email=email,
-    )
-    customer.name = name
-    customer.save()
-
-    order = Order.objects.create(
-        customer=customer,
-        complete=False,
-    )
+    with transaction.atomic():
+        customer, created = Customer.objects.get_or_create(
+            email=email,
+            defaults={'name': name},
+        )
+        if customer.name != name:
+            customer.name = name
+            customer.save(update_fields=['name'])
 
-    for item in items:
-        product = Product.objects.get(id=item['id'])
-        orderItem = OrderItem.objects.create(
-            product=product,
-            order=order,
-            quantity=item['quantity'],  # Assuming negative quantity is not needed for guest orders
+        order = Order.objects.create(
+            customer=customer,
+            complete=False,
+            total=sum(item.get_total for item in items),
+            item_count=sum(item.quantity for item in items),
         )
-    return customer, order
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+
+    order.shipping = any(item.product.digital == False for item in items)
+    return customer, order, items
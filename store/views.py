@@ -1,41 +1,50 @@
-from django.shortcuts import render,redirect
-from django.http import JsonResponse
+from django.shortcuts import render,redirect,get_object_or_404
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 
 import json
 import datetime
+import hashlib
 import logging
 
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
+from django.views.decorators.http import condition, require_POST
 from django.contrib.auth import update_session_auth_hash
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import PasswordChangeForm
 from django.conf import settings
+from django.utils import timezone
 from django.contrib import messages
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User, auth
+from django.db.models import Prefetch, Q
 from .models import *
-from .utils import cookieCart, cartData, guestOrder
-
+from .cart import CartError, customer_for, parse_cart_ops, update_cookie_cart, update_order_cart
+from .checkout import CheckoutError, clean_checkout_form, new_idempotency_key, place_order
+from .db import retry_on_locked
+from .prerender import prerendered
+from .search import search_products
+from .reports import REPORT_MAX_DAYS, sales_report
+from .exports import EXPORT_FORMATS, ExportError, export_lines, export_queryset, parse_export_date
+from .catalog import CATALOG_SORTS, catalog_page, get_catalog, storefront_version
+from .utils import CART_COOKIE, cookieCart, orderCursor, parseOrderCursor, readCartCookie, writeCartCookie
+
+def storefront_etag(request, *args, **kwargs):
+    # The product grid only changes with the catalog; the rest of the page
+    # depends on who is logged in and what is in their cart.
+    user = request.user.pk if request.user.is_authenticated else ''
+    key = '%s:%s:%s' % (storefront_version(), user, request.cart.count)
+    return hashlib.md5(key.encode()).hexdigest()
+
+@ensure_csrf_cookie
+@condition(etag_func=storefront_etag)
 def main(request):
-    data = cartData(request)
-
-    cartItems = data['cartItems']
-    order = data['order']
-    items = data['items']
-
-    products = Product.objects.all()
-    context = {'products': products, 'cartItems': cartItems}
+    context = {'products': get_catalog, 'catalog_version': storefront_version()}
     return render(request,'store/main.html', context)
 
 def log_use(request,cp_name):
     username=cp_name
-    data = cartData(request)
-
-    cartItems = data['cartItems']
-    order = data['order']
-    items = data['items']
-
-    products = Product.objects.all()
-    context = {'products': products, 'cartItems': cartItems}
+    context = {'products': get_catalog, 'catalog_version': storefront_version()}
     
     if request.user.is_authenticated:
         context['username'] = username
@@ -43,81 +52,114 @@ def log_use(request,cp_name):
     else:
         return render(request, 'store/store.html', context)
     
+@ensure_csrf_cookie
+@condition(etag_func=storefront_etag)
 def store(request):
-    data = cartData(request)
-
-    cartItems = data['cartItems']
-    order = data['order']
-    items = data['items']
-
-    products = Product.objects.all()
-    context = {'products': products, 'cartItems': cartItems}
+    context = {'products': get_catalog, 'catalog_version': storefront_version()}
 
     return render(request, 'store/store.html', context)
 
 
-def cart(request):
-    data = cartData(request)
-
-    cartItems = data['cartItems']
-    order = data['order']
-    items = data['items']
-
-    context = {'items': items, 'order': order, 'cartItems': cartItems}
-    return render(request, 'store/cart.html', context)
+def product_list(request):
+    try:
+        min_price = int(request.GET['min_price']) if request.GET.get('min_price') else None
+        max_price = int(request.GET['max_price']) if request.GET.get('max_price') else None
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return JsonResponse({'error': 'min_price, max_price and page must be integers'}, status=400)
 
+    sort = request.GET.get('sort', 'name')
+    if sort not in CATALOG_SORTS:
+        return JsonResponse({'error': 'sort must be one of %s' % ', '.join(CATALOG_SORTS)}, status=400)
 
-def checkout(request):
-    data = cartData(request)
+    products, has_next = catalog_page(min_price, max_price, sort, page)
+    return JsonResponse({'products': products, 'page': page, 'next_page': page + 1 if has_next else None})
 
-    cartItems = data['cartItems']
-    order = data['order']
-    items = data['items']
 
-    context = {'items': items, 'order': order, 'cartItems': cartItems}
-    return render(request, 'store/checkout.html', context)
+@ensure_csrf_cookie
+def search(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
 
+    products, has_next = search_products(query, page)
+    context = {'products': products, 'query': query, 'page': page, 'has_next': has_next}
+    return render(request, 'store/search.html', context)
 
-def updateItem(request):
-    data = json.loads(request.body)
-    productId = data['productId']
-    action = data['action']
-    print('Action:', action)
-    print('Product:', productId)
 
-    customer = request.user.customer
-    product = Product.objects.get(id=productId)
-    order, created = Order.objects.get_or_create(customer=customer, complete=False)
-
-    orderItem, created = OrderItem.objects.get_or_create(order=order, product=product)
-
-    if action == 'add':
-        orderItem.quantity = (orderItem.quantity + 1)
-    elif action == 'remove':
-        orderItem.quantity = (orderItem.quantity - 1)
+@ensure_csrf_cookie
+def cart(request):
+    context = {'items': request.cart.items, 'order': request.cart.order}
+    return render(request, 'store/cart.html', context)
 
-    orderItem.save()
 
-    if orderItem.quantity <= 0:
-        orderItem.delete()
+def checkout(request):
+    context = {
+        'items': request.cart.items,
+        'order': request.cart.order,
+        'idempotency_key': new_idempotency_key(),
+    }
+    return render(request, 'store/checkout.html', context)
 
-    return JsonResponse('Item was added', safe=False)
 
+def applyCartChanges(request, changes):
+    if request.user.is_authenticated:
+        return None, update_order_cart(customer_for(request.user), changes)
+    return update_cookie_cart(request, changes)
+
+@require_POST
+@retry_on_locked
+def updateCart(request):
+    try:
+        data = json.loads(request.body)
+        changes = parse_cart_ops(data.get('ops'))
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    cart, payload = applyCartChanges(request, changes)
+    response = JsonResponse(payload)
+    if cart is not None:
+        writeCartCookie(response, cart)
+    return response
+
+@retry_on_locked
+def updateItem(request):
+    try:
+        data = json.loads(request.body)
+        changes = parse_cart_ops([{'productId': data['productId'], 'action': data['action']}])
+    except (ValueError, AttributeError, KeyError, TypeError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    cart, payload = applyCartChanges(request, changes)
+    response = JsonResponse('Item was added', safe=False)
+    if cart is not None:
+        writeCartCookie(response, cart)
+    return response
+
+@retry_on_locked
+@require_POST
 def order(request):
-    if request.method == "POST":
-        # Extract data from POST request using .get() method
-        username = request.POST.get('name')
-        email = request.POST.get('email')
-        street = request.POST.get('street')
-        city = request.POST.get('city')
-        state = request.POST.get('state')
-        pincode = request.POST.get('pincode')
+    try:
+        form = clean_checkout_form(request.POST)
+        order, created = place_order(request, form)
+    except CheckoutError as e:
+        messages.error(request, str(e))
+        return redirect('checkout')
 
-        # Save to the database
-        data = UserAddress(username=username,email=email,street=street, city=city,state=state, pincode=pincode)
-        data.save()
-
-    return redirect('store')
+    if request.user.is_authenticated:
+        response = redirect('order_details', order_id=order.id)
+    else:
+        # Guests have no order history to redirect to; a refresh re-posts the
+        # same idempotency key and shows this order again.
+        items = list(order.orderitem_set.select_related('product'))
+        response = render(request, 'store/order_details.html', {'order': order, 'items': items})
+    if created:
+        messages.success(request, 'Order placed successfully!')
+    if readCartCookie(request):
+        response.delete_cookie(CART_COOKIE)
+    return response
 
 from django.db import IntegrityError
 
@@ -192,45 +234,80 @@ def profile(request):
     return render(request, 'store/profile.html', {
         'user': request.user,
         'username': request.user.username,
-        'cartItems': cartData(request)['cartItems']
     })
 
 def navbar(request):
     return render(request, 'store/navbar.html')
 
+@prerendered('contact_us')
 def contact_us(request):
     return render(request, 'store/contact_us.html')
 
+@prerendered('about_us')
 def about_us(request):
     return render(request, 'store/about_us.html')
 
+@prerendered('faq')
 def faq(request):
     return render(request, 'store/faq.html')
 
+@prerendered('track')
 def track(request):
     return render(request, 'store/track.html')
 
+@prerendered('returns')
 def returns(request):
     return render(request, 'store/return.html')
 
+@prerendered('offer')
 def offer(request):
     return render(request, 'store/offer.html')
 
+@prerendered('gift')
 def gift(request):
     return render(request, 'store/gift.html')
 
+@prerendered('career')
 def career(request):
     return render(request, 'store/career.html')
 
+@prerendered('press')
 def press(request):
     return render(request, 'store/press.html')
 
+@prerendered('blog')
 def blog(request):
     return render(request, 'store/blog.html')
 
+ORDER_HISTORY_PAGE_SIZE = 20
+
+@login_required
 def order_history(request):
-    orders = Order.objects.filter(customer=request.user.customer)
-    return render(request, 'store/order_history.html', {'orders': orders})
+    orders = Order.objects.filter(customer=request.user.customer).order_by('-date_order', '-id')
+
+    cursor = parseOrderCursor(request.GET.get('before'))
+    if cursor:
+        date_order, order_id = cursor
+        orders = orders.filter(Q(date_order__lt=date_order) | Q(date_order=date_order, id__lt=order_id))
+
+    orders = list(orders[:ORDER_HISTORY_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(orders) > ORDER_HISTORY_PAGE_SIZE:
+        orders = orders[:ORDER_HISTORY_PAGE_SIZE]
+        next_cursor = orderCursor(orders[-1])
+
+    return render(request, 'store/order_history.html', {'orders': orders, 'next_cursor': next_cursor})
+
+@login_required
+def order_details(request, order_id):
+    orders = Order.objects.select_related('customer').prefetch_related(
+        Prefetch('orderitem_set', queryset=OrderItem.objects.select_related('product')),
+    )
+    order = get_object_or_404(orders, id=order_id, customer=request.user.customer)
+
+    items = list(order.orderitem_set.all())
+    order.shipping = any(item.product and item.product.digital == False for item in items)
+    return render(request, 'store/order_details.html', {'order': order, 'items': items})
 
 
 def update_profile(request):
@@ -261,4 +338,33 @@ def update_password(request):
     return render(request, 'store/update_password.html', {'form': form})
 
 def track_order(request):
-    return redirect('store')
\ No newline at end of file
+    return redirect('store')
+
+@staff_member_required
+def export_orders(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('format must be one of: %s' % ', '.join(EXPORT_FORMATS))
+    try:
+        since = parse_export_date(request.GET.get('since'), 'since')
+        until = parse_export_date(request.GET.get('until'), 'until')
+    except ExportError as e:
+        return HttpResponseBadRequest(str(e))
+    complete = {'1': True, '0': False}.get(request.GET.get('complete'))
+
+    response = StreamingHttpResponse(
+        export_lines(fmt, export_queryset(since, until, complete)),
+        content_type='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+    )
+    response['Content-Disposition'] = 'attachment; filename="orders.%s"' % fmt
+    return response
+
+@staff_member_required
+def sales_dashboard(request):
+    try:
+        days = min(max(int(request.GET.get('days', 30)), 1), REPORT_MAX_DAYS)
+    except ValueError:
+        return HttpResponseBadRequest('days must be a number')
+    end = timezone.localdate()
+    report = sales_report(end - datetime.timedelta(days=days - 1), end)
+    return render(request, 'store/sales_dashboard.html', dict(report, days_shown=days))